@@ -7,23 +7,68 @@ Anime Frame v2
 - SQLite DB for persistent state
 """
 
-import os, json, time, threading, signal, sqlite3, subprocess, sys
-from datetime import datetime, time as dt_time
-from flask import Flask, render_template_string, request, jsonify, send_from_directory
+import os, json, time, threading, signal, sqlite3, subprocess, sys, socket, codecs, collections, queue, itertools, hashlib, uuid, contextlib, re, bisect, concurrent.futures
+from datetime import datetime
+from flask import Flask, Response, render_template_string, request, jsonify, send_from_directory, send_file, g, abort, make_response
+from urllib.parse import quote, urlparse
 import requests
 from smbus2 import SMBus
 
 # ---------------- CONFIG ----------------
-KODI_URL = "http://localhost:8080/jsonrpc"
+def _env(name, default):
+    # ANIME_FRAME_<name> in the environment overrides a path/port setting (bench_anime_frame.py
+    # uses this to run against a synthetic library and a fake Kodi); empty means None
+    v = os.environ.get("ANIME_FRAME_" + name)
+    if v is None: return default
+    if isinstance(default, list): return json.loads(v) if v else default
+    return (int(v) if isinstance(default, int) else v) if v else None
+
+KODI_URL = _env("KODI_URL", "http://localhost:8080/jsonrpc")
 KODI_AUTH = ("", "")  # set if you used kodi username/password
-ANIME_DIR = "/media/anime"
-STATIC_DIR = "/home/pi/anime_static"
-DB_FILE = "/home/pi/anime_frame.db"
+KODI_EVENTS_HOST = _env("KODI_EVENTS_HOST", "localhost")  # Kodi JSON-RPC TCP notifications; set port to None to disable
+KODI_EVENTS_PORT = _env("KODI_EVENTS_PORT", 9090)
+KODI_HEARTBEAT = 15    # sec between safety polls of Kodi while notifications are connected
+KODI_START_TIMEOUT = 15  # sec to wait for Kodi to start playing a file before giving up on the seek
+KODI_PROBE_MIN = 1     # sec; first retry after Kodi stops answering (doubles up to KODI_PROBE_MAX)
+KODI_PROBE_MAX = 15    # sec; longest gap between background probes while Kodi is down
+KODI_BREAKER_FAILURES = 3  # failed requests in a row before Kodi counts as down
+KODI_PLAYLIST = 1      # Kodi's video playlist; the next episode is queued here for gapless playback
+ANIME_DIR = _env("ANIME_DIR", "/media/anime")
+STATIC_DIR = _env("STATIC_DIR", "/home/pi/anime_static")
+DB_FILE = _env("DB_FILE", "/home/pi/anime_frame.db")
 BH1750_ADDR = 0x23
 I2C_BUS = 1
 LIGHT_THRESHOLD = 30   # lux
+LIGHT_HYSTERESIS = 5   # lux; the smoothed value must leave threshold +/- this to flip bright/dark
+LUX_SAMPLE_INTERVAL = 1.0  # sec between light sensor reads
+LUX_SMOOTHING = 9      # samples in the moving median used for decisions
+LUX_HISTORY = 900      # samples kept for /api/lux/history
+LUX_REPORT_CHANGE = 0.1  # relative change of the smoothed lux pushed to the UI (bright/dark flips always are)
 SENSOR_POLL = 3        # sec
-FLASK_PORT = 5000
+SCHEDULE_MAX_SLEEP = 600  # sec; longest idle sleep before re-checking the schedule (clock/DST changes)
+LIBRARY_RECHECK = 10   # sec between folder mtime checks per show
+THUMB_WORKERS = 2      # max concurrent ffmpeg thumbnail jobs
+THUMB_NEXT_UP = 6      # shows at the head of the playlist whose thumbnails are generated first
+THUMB_RETRY = 600      # sec before retrying a show whose thumbnail could not be generated
+PROBE_WORKERS = 2      # max concurrent ffprobe runs (duration/stream info of each episode, probed once)
+PROBE_TIMEOUT = 30     # sec per ffprobe run
+PROBE_BATCH = 50       # probe results written per transaction
+POSTER_SIZE = (360, 440)  # max size of the poster variants served to the UI (cards at 2x)
+POSTER_FORMAT = "webp"    # "webp" or "jpeg"
+POSTER_MAX_AGE = 365*24*3600  # sec; versioned poster URLs never change
+FLASK_PORT = _env("FLASK_PORT", 5000)
+DB_POOL_SIZE = 4       # idle SQLite connections kept open for reuse
+PROGRESS_FLUSH = 60    # sec between progress writes during playback (max progress lost on a crash)
+DB_CACHE_KB = 4096     # SQLite page cache per connection
+SSE_KEEPALIVE = 30     # sec between keepalive comments on idle /api/events streams
+LONG_POLL_MAX = 30     # sec a /api/state?since=..&wait=.. request may block
+STATE_PAGE_MAX = 500   # most shows in one /api/state?limit=.. page
+# picture frames (Kodi boxes) driven by this process, each with its own rotation, progress,
+# schedule and light sensor; the library and posters are shared. keys left out fall back to the
+# settings above: name, kodi_url, kodi_auth, events_host, events_port, i2c_bus, bh1750_addr
+# (events_host defaults to the host in the frame's own kodi_url).
+# ANIME_FRAME_FRAMES='[{"name":"living"},{"name":"hall","kodi_url":"http://hall:8080/jsonrpc"}]'
+FRAMES_CONFIG = _env("FRAMES", [{"name": "default"}])
 
 # ---------------- FLASK TEMPLATE ----------------
 UI_TEMPLATE = """<!doctype html><html><head><meta charset="utf-8">
@@ -32,12 +77,15 @@ UI_TEMPLATE = """<!doctype html><html><head><meta charset="utf-8">
 body{background:#071021;color:#e7f0f7;font-family:Inter,system-ui;padding:12px}
 .header{display:flex;justify-content:space-between;align-items:center}
 .controls button{margin-left:8px;padding:6px 10px;border-radius:8px;border:0;background:#13334a;color:#fff}
-.grid{display:grid;grid-template-columns:repeat(auto-fill,minmax(180px,1fr));gap:12px;margin-top:14px}
-.card{background:#0b1b28;border-radius:10px;overflow:hidden}
-.poster{height:220px;background:#09121a;background-size:cover;background-position:center}
+.grid{position:relative;margin-top:14px}
+.card{position:absolute;top:0;left:0;height:318px;background:#0b1b28;border-radius:10px;overflow:hidden}
+.card.playing{outline:2px solid #3fa7d6}
+.poster{position:relative;height:220px;background:#09121a;background-size:cover;background-position:center}
+.bar{position:absolute;left:0;right:0;bottom:0;height:4px;background:#0009}
+.bar i{display:block;height:100%;width:0;background:#3fa7d6}
 .info{padding:10px}
-.title{font-weight:700;margin:0 0 6px}
-.meta{color:#8aa0b1;font-size:13px;margin-bottom:8px}
+.title{font-weight:700;margin:0 0 6px;white-space:nowrap;overflow:hidden;text-overflow:ellipsis}
+.meta{color:#8aa0b1;font-size:13px;margin-bottom:8px;white-space:nowrap;overflow:hidden;text-overflow:ellipsis}
 .btns{display:flex;gap:6px}
 .btn{flex:1;padding:7px;border-radius:8px;border:0;background:#123b52;color:#fff;font-size:13px}
 .settings{margin-top:18px;background:#071a29;padding:12px;border-radius:8px}
@@ -46,16 +94,25 @@ body{background:#071021;color:#e7f0f7;font-family:Inter,system-ui;padding:12px}
 <div class="header">
   <div>
     <h2 style="margin:0">Anime Frame</h2>
-    <div class="small">Lux: <span id="lux">--</span> • Schedule: <span id="sched">--</span></div>
+    <div class="small">Lux: <span id="lux">--</span> • Kodi: <span id="kodi">--</span> • Schedule: <span id="sched">--</span></div>
   </div>
   <div class="controls">
-    <button onclick="fetch('/api/play').then(()=>load())">Play</button>
-    <button onclick="fetch('/api/pause').then(()=>load())">Pause</button>
-    <button onclick="fetch('/api/refresh').then(()=>load())">Refresh shows</button>
+    <select id="frame" style="display:none;padding:6px;border-radius:8px;border:0"></select>
+    <button onclick="fetch('/api/play')">Play</button>
+    <button onclick="fetch(api('/api/pause'))">Pause</button>
+    <button onclick="fetch('/api/refresh')">Refresh shows</button>
   </div>
 </div>
 
 <div style="display:flex;gap:14px;margin-top:12px">
+  <div>
+    <input id="q" placeholder="Search shows" style="padding:8px;border-radius:8px;border:0;width:200px">
+    <select id="filter" style="padding:8px;border-radius:8px;border:0;margin-left:6px">
+      <option value="">All</option><option value="started">Started</option>
+      <option value="unstarted">Not started</option><option value="playing">Playing</option>
+    </select>
+    <div class="small" style="margin-top:4px"><span id="count">--</span> shows</div>
+  </div>
   <form id="addForm" onsubmit="addShow(event)">
     <input name="show" placeholder="Add folder name" required style="padding:8px;border-radius:8px;border:0;width:260px">
     <button class="btn" style="margin-left:6px">Add</button>
@@ -70,70 +127,453 @@ body{background:#071021;color:#e7f0f7;font-family:Inter,system-ui;padding:12px}
       <label class="small" style="margin-left:10px">End: <input id="sched_end" type="time"></label>
       <button onclick="saveSched()" class="btn" style="margin-left:8px">Save</button>
     </div>
+    <div style="margin-top:8px">
+      <label class="small">Windows: <input id="sched_windows" placeholder="Mon-Fri 18:00-23:00; Sat,Sun 09:00-23:30" style="width:300px"></label>
+      <div class="small">Optional; replaces start/end. Blank days = every day.</div>
+    </div>
   </div>
 </div>
 
 <div id="grid" class="grid"></div>
 
 <script>
-async function load(){
-  const r = await fetch('/api/state'); const st = await r.json();
-  document.getElementById('lux').innerText = st.lux ?? '--';
-  document.getElementById('sched').innerText = st.schedule_enabled ? `${st.schedule_start} → ${st.schedule_end}` : 'disabled';
-  document.getElementById('use_light').checked = st.use_light;
-  document.getElementById('use_sched').checked = st.schedule_enabled;
-  document.getElementById('sched_start').value = st.schedule_start || '';
-  document.getElementById('sched_end').value = st.schedule_end || '';
-  render(st.playlist);
+// virtual grid: the shows are paged in from /api/state (cursor pages, same search/filter) as the
+// list is scrolled, and only the cards in or near the viewport exist in the DOM, so posters are
+// only requested for cards that come into view. /api/events?limit=0 streams changes
+const PAGE = 120, CARD_W = 180, CARD_H = 318, GAP = 12, OVERSCAN = 2;  // OVERSCAN: rows above/below view
+let items = [];      // loaded shows, in playlist order
+let total = 0, cursor = null, loading = false, gen = 0, nowPlaying = null, es = null;
+let cards = {};      // name -> {card, poster, meta, item} for the rendered cards only
+let frameName = '';  // frame picked in the header ('' = the first one)
+const grid = document.getElementById('grid');
+
+function api(path){
+  // per-frame endpoints: add ?frame= for the picked frame
+  return frameName ? path + (path.includes('?') ? '&' : '?') + 'frame=' + encodeURIComponent(frameName) : path;
+}
+
+function params(extra){
+  const p = new URLSearchParams(extra);
+  const q = document.getElementById('q').value.trim(), f = document.getElementById('filter').value;
+  if(frameName) p.set('frame', frameName);
+  if(q) p.set('q', q);
+  if(f) p.set('filter', f);
+  return p.toString();
+}
+
+async function loadFrames(){
+  // the picker only shows up when this process drives more than one frame
+  try {
+    const frames = (await (await fetch('/api/frames')).json()).frames;
+    const sel = document.getElementById('frame');
+    frames.forEach(f => { const o = el('option'); o.value = o.textContent = f.name; sel.appendChild(o); });
+    sel.style.display = frames.length > 1 ? '' : 'none';
+  } catch(e) {}
+}
+
+function connect(){
+  // (re)start from the first page for the current search/filter
+  gen++; items = []; cursor = null; total = 0; loading = false;
+  Object.keys(cards).forEach(removeCard);
+  if(es) es.close();
+  es = new EventSource('/api/events?' + params({limit: 0}));
+  es.onmessage = e => applyState(JSON.parse(e.data));
+}
+
+async function loadPage(){
+  if(loading) return;
+  loading = true;
+  const my = gen;
+  let st = null;
+  try { st = await (await fetch('/api/state?' + params(cursor === null ? {limit: PAGE} : {limit: PAGE, cursor}))).json(); } catch(e) {}
+  if(my !== gen) return;   // search changed while this was in flight
+  loading = false;
+  if(!st || !st.playlist) return;
+  // the page follows the loaded ones; a delta may already have brought some of it in
+  st.playlist.forEach(item => { const i = items.findIndex(x => x.name === item.name); if(i >= 0) items.splice(i, 1); items.push(item); });
+  cursor = st.next_cursor; total = st.total;
+  render();
+}
+
+function applyState(st){
+  if(st.lux !== undefined) document.getElementById('lux').innerText = st.lux ?? '--';
+  if(st.kodi !== undefined) document.getElementById('kodi').innerText = st.kodi.up ? 'online' : 'offline';
+  if(st.use_light !== undefined){
+    document.getElementById('sched').innerText = !st.schedule_enabled ? 'disabled' : (st.schedule_windows || `${st.schedule_start} → ${st.schedule_end}`);
+    document.getElementById('use_light').checked = st.use_light;
+    document.getElementById('use_sched').checked = st.schedule_enabled;
+    document.getElementById('sched_start').value = st.schedule_start || '';
+    document.getElementById('sched_end').value = st.schedule_end || '';
+    document.getElementById('sched_windows').value = st.schedule_windows || '';
+  }
+  if(st.now_playing !== undefined) nowPlaying = st.now_playing;
+  if(st.total !== undefined) total = st.total;
+  if(st.full){
+    // first message (or the server restarted): page the shows in again
+    items = []; cursor = null; loading = false; gen++;
+    loadPage();
+    return;
+  }
+  st.removed.forEach(n => { const i = items.findIndex(x => x.name === n); if(i >= 0) items.splice(i, 1); });
+  st.playlist.forEach(upsert);
+  render();
 }
 
+function upsert(item){
+  // keep items sorted by order; a show that moved past the loaded pages is dropped here and
+  // comes back with its page
+  const i = items.findIndex(x => x.name === item.name);
+  if(i >= 0) items.splice(i, 1);
+  if(cursor !== null && !(items.length && item.order <= items[items.length-1].order)) return;
+  let j = items.length;
+  while(j > 0 && items[j-1].order > item.order) j--;
+  items.splice(j, 0, item);
+}
+
+function render(){
+  document.getElementById('count').innerText = total;
+  const cols = Math.max(1, Math.floor((grid.clientWidth + GAP) / (CARD_W + GAP)));
+  const w = (grid.clientWidth - GAP*(cols-1)) / cols;
+  grid.style.height = Math.ceil(total / cols) * (CARD_H + GAP) + 'px';
+  const top = -grid.getBoundingClientRect().top;
+  const first = Math.max(0, Math.floor(top / (CARD_H + GAP)) - OVERSCAN) * cols;
+  const last = Math.min(total, (Math.ceil((top + innerHeight) / (CARD_H + GAP)) + OVERSCAN) * cols);
+  if(last > items.length && cursor !== null) loadPage();
+  const keep = new Set();
+  for(let i = first; i < Math.min(last, items.length); i++){
+    const item = items[i];
+    keep.add(item.name);
+    const c = upsertCard(item);
+    c.card.style.width = w + 'px';
+    c.card.style.transform = `translate(${(i % cols) * (w + GAP)}px, ${Math.floor(i / cols) * (CARD_H + GAP)}px)`;
+    c.card.classList.toggle('playing', item.name === nowPlaying);
+  }
+  Object.keys(cards).forEach(n => { if(!keep.has(n)) removeCard(n); });
+}
+
+let raf = 0;
+function schedule(){ if(!raf) raf = requestAnimationFrame(() => { raf = 0; render(); }); }
+addEventListener('scroll', schedule, {passive: true});
+addEventListener('resize', schedule);
+
 function el(tag,cls,html){ let e=document.createElement(tag); if(cls) e.className=cls; if(html!==undefined) e.innerHTML=html; return e; }
 
-function render(list){
-  const g = document.getElementById('grid'); g.innerHTML='';
-  list.forEach(item=>{
-    const c = el('div','card');
-    const poster = el('div','poster'); poster.style.backgroundImage = `url("/poster/${encodeURIComponent(item.name)}?t=${Date.now()}")`;
-    c.appendChild(poster);
+function hms(ms){ const s = Math.floor(ms/1000); return [Math.floor(s/3600), Math.floor(s/60) % 60, s % 60].map(v => String(v).padStart(2,'0')).join(':'); }
+
+function removeCard(name){ const c = cards[name]; if(c){ c.card.remove(); delete cards[name]; } }
+
+function upsertCard(item){
+  let c = cards[item.name];
+  if(!c){
+    const card = el('div','card');
+    const poster = el('div','poster');
+    const bar = el('i'); poster.appendChild(el('div','bar')).appendChild(bar);
+    card.appendChild(poster);
     const info=el('div','info');
-    info.appendChild(el('div','title',item.name));
-    info.appendChild(el('div','meta',`Ep: ${item.current_ep_name || '?'} • progress: ${item.position || '0:00'}`));
+    const title = el('div','title'); title.textContent = item.name; title.title = item.name;
+    info.appendChild(title);
+    const meta = el('div','meta'); info.appendChild(meta);
     const btns=el('div','btns');
-    const play=el('button','btn','Start'); play.onclick=()=>fetch(`/api/start/${encodeURIComponent(item.name)}`).then(()=>load());
-    const restart=el('button','btn','Restart'); restart.onclick=()=>fetch(`/api/restart/${encodeURIComponent(item.name)}`).then(()=>load());
-    const remove=el('button','btn','Remove'); remove.onclick=()=>{ if(confirm('Remove?')) fetch(`/api/remove/${encodeURIComponent(item.name)}`).then(()=>load()); };
+    const play=el('button','btn','Start'); play.onclick=()=>fetch(api(`/api/start/${encodeURIComponent(item.name)}`));
+    const restart=el('button','btn','Restart'); restart.onclick=()=>fetch(api(`/api/restart/${encodeURIComponent(item.name)}`));
+    const remove=el('button','btn','Remove'); remove.onclick=()=>{ if(confirm('Remove?')) fetch(api(`/api/remove/${encodeURIComponent(item.name)}`)); };
     btns.appendChild(play); btns.appendChild(restart); btns.appendChild(remove);
-    info.appendChild(btns); c.appendChild(info); g.appendChild(c);
-  });
+    info.appendChild(btns); card.appendChild(info);
+    // drag a card onto another to move it in front of that one
+    card.draggable = true;
+    card.ondragstart = e => e.dataTransfer.setData('text/plain', item.name);
+    card.ondragover = e => e.preventDefault();
+    card.ondrop = e => { e.preventDefault(); moveShow(e.dataTransfer.getData('text/plain'), item.name); };
+    grid.appendChild(card);
+    c = cards[item.name] = {card, poster, bar, meta, item: null};
+  }
+  if(!c.item || c.item.poster !== item.poster) c.poster.style.backgroundImage = `url("${item.poster}")`;
+  // durations come from the background ffprobe pass; until then only the position is known
+  const dur = item.duration_ms ? ` / ${hms(item.duration_ms)} (${item.episode_pct}%)` : '';
+  const series = item.series_pct != null ? ` • series ${item.series_pct}%` : '';
+  c.meta.textContent = `Ep: ${item.current_ep_name || '?'} • ${item.position || '0:00'}${dur}${series}`;
+  c.meta.title = c.meta.textContent;
+  c.bar.style.width = (item.series_pct ?? 0) + '%';
+  c.item = item;
+  return c;
 }
 
-async function addShow(e){ e.preventDefault(); const fd=new FormData(e.target); await fetch('/api/add',{method:'POST',body:fd}); e.target.reset(); load(); }
+function moveShow(name, target){
+  if(!name || name === target) return;
+  fetch(api('/api/reorder'),{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({name, before: target})});
+}
+async function addShow(e){ e.preventDefault(); const fd=new FormData(e.target); await fetch(api('/api/add'),{method:'POST',body:fd}); e.target.reset(); }
 async function saveSched(){
   const body = {use_light: document.getElementById('use_light').checked,
                 schedule_enabled: document.getElementById('use_sched').checked,
                 schedule_start: document.getElementById('sched_start').value,
-                schedule_end: document.getElementById('sched_end').value};
-  await fetch('/api/settings',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(body)});
-  load();
+                schedule_end: document.getElementById('sched_end').value,
+                schedule_windows: document.getElementById('sched_windows').value};
+  const r = await fetch(api('/api/settings'),{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(body)});
+  if(!r.ok) alert((await r.json()).msg);
 }
-load();
-setInterval(load,4000);
+let typing = 0;
+document.getElementById('q').oninput = () => { clearTimeout(typing); typing = setTimeout(connect, 250); };
+document.getElementById('filter').onchange = connect;
+document.getElementById('frame').onchange = e => { frameName = e.target.value; connect(); };
+// EventSource reconnects by itself and resumes from the last event id
+loadFrames();
+connect();
 </script>
 </body></html>"""
 
+# ---------------- Metrics ----------------
+# counters and latency histograms, served at /metrics in the Prometheus text format. each
+# update is a dict lookup and an add under a per-metric lock, cheap enough to leave on
+METRICS = []
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+def _labels(names, values):
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{n}="{esc(v)}"' for n,v in zip(names, values))
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.lock = threading.Lock()
+        self.values = {}    # label values -> count
+        METRICS.append(self)
+
+    def inc(self, *labels, n=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + n
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for k,v in items:
+            out.append(f"{self.name}{{{_labels(self.labels, k)}}} {v}" if k else f"{self.name} {v}")
+        return out
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.lock = threading.Lock()
+        self.values = {}    # label values -> [per-bucket counts (+Inf last), sum]
+        METRICS.append(self)
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            v = self.values.get(labels)
+            if v is None: v = self.values[labels] = [[0]*(len(self.buckets)+1), 0.0]
+            v[0][i] += 1
+            v[1] += value
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, *labels)
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((k, (list(v[0]), v[1])) for k,v in self.values.items())
+        for k,(counts,total) in items:
+            lbl = _labels(self.labels, k)
+            sep = "," if lbl else ""
+            acc = 0
+            for b,c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le = "+Inf" if b == float("inf") else repr(b)
+                out.append(f'{self.name}_bucket{{{lbl}{sep}le="{le}"}} {acc}')
+            out.append(f"{self.name}_sum{{{lbl}}} {total}" if lbl else f"{self.name}_sum {total}")
+            out.append(f"{self.name}_count{{{lbl}}} {acc}" if lbl else f"{self.name}_count {acc}")
+        return out
+
+class Gauge:
+    # value read when /metrics is scraped; with labels, fn returns {label values: value}
+    def __init__(self, name, help, fn, labels=()):
+        self.name, self.help, self.fn, self.labels = name, help, fn, labels
+        METRICS.append(self)
+
+    def render(self):
+        try:
+            v = self.fn()
+        except Exception:
+            return []
+        if not self.labels: v = {(): v}
+        values = sorted((k, x) for k,x in v.items() if x is not None)
+        if not values: return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"] + [
+            f"{self.name}{{{_labels(self.labels, k)}}} {float(x)}" if k else f"{self.name} {float(x)}" for k,x in values]
+
+def metrics_text():
+    return "\n".join(line for m in METRICS for line in m.render()) + "\n"
+
+M_KODI_CALLS = Counter("animeframe_kodi_rpc_calls_total", "Kodi JSON-RPC calls by frame, method and result (ok, error, failed, skipped)", ("frame","method","result"))
+M_KODI_SECONDS = Histogram("animeframe_kodi_rpc_seconds", "Kodi JSON-RPC round trip time by frame and request (batched methods joined with +)", ("frame","method"))
+M_DB_LOCK_WAIT = Histogram("animeframe_db_lock_wait_seconds", "Time waiting for the SQLite write lock")
+M_DB_COMMIT = Histogram("animeframe_db_commit_seconds", "SQLite COMMIT time")
+M_DB_TX = Counter("animeframe_db_transactions_total", "Write transactions by result", ("result",))
+M_SCAN_SECONDS = Histogram("animeframe_library_scan_seconds", "Time to scan one show folder", ("kind",))
+M_SCAN_DIRS = Counter("animeframe_library_dirs_listed_total", "Folders listed by library scans (unchanged folders are not listed)")
+M_THUMB_SECONDS = Histogram("animeframe_thumbnail_seconds", "Thumbnail extraction (ffmpeg) and poster resizing time", ("stage",))
+M_THUMBS = Counter("animeframe_thumbnails_total", "Thumbnail jobs by result", ("result",))
+M_PROBE_SECONDS = Histogram("animeframe_probe_seconds", "ffprobe run time per episode")
+M_PROBES = Counter("animeframe_probes_total", "Episode probes by result (ok, unreadable, failed)", ("result",))
+M_LUX_SECONDS = Histogram("animeframe_lux_read_seconds", "BH1750 read time")
+M_LUX_READS = Counter("animeframe_lux_reads_total", "BH1750 reads by result", ("result",))
+M_HTTP_SECONDS = Histogram("animeframe_http_request_seconds", "Flask request latency by route (time to the response, not the end of a stream)", ("route","method","status"))
+START_TIME = time.time()
+Gauge("animeframe_start_time_seconds", "Unix time the process started", lambda: START_TIME)
+Gauge("animeframe_kodi_up", "1 while the frame's Kodi answers (circuit breaker closed)", lambda: {(f.name,): f.kodi.up for f in FRAMES}, ("frame",))
+Gauge("animeframe_kodi_events_connected", "1 while the frame's Kodi notification socket is connected", lambda: {(f.name,): f.events.connected for f in FRAMES}, ("frame",))
+Gauge("animeframe_lux", "Smoothed light level (lux) seen by each frame", lambda: {(f.name,): f.lux.lux() for f in FRAMES}, ("frame",))
+
+# ---------------- State versions ----------------
+SETTING_KEYS = ("use_light","schedule_enabled","schedule_start","schedule_end","schedule_windows")
+
+class StateVersions:
+    # version counter bumped on every change to the DB or the playback state. each show,
+    # the settings and the status (lux, now playing) remember the version they last changed
+    # at, so clients can fetch only what changed after the version they have
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.epoch = uuid.uuid4().hex[:8]   # versions restart with the process
+        self.version = 0
+        self.shows = {}     # name -> version of last change
+        self.removed = {}   # name -> version it was removed at
+        self.settings = 0
+        self.status = 0
+
+    def touch(self, shows=(), removed=(), settings=False, status=False):
+        with self.cond:
+            self.version += 1
+            for n in shows:
+                self.shows[n] = self.version
+                self.removed.pop(n, None)
+            for n in removed:
+                self.removed[n] = self.version
+                self.shows.pop(n, None)
+            if settings: self.settings = self.version
+            if status: self.status = self.version
+            self.cond.notify_all()
+
+    def parse(self, token):
+        # "<epoch>-<version>" from a client; None (= send everything) if unknown or from an older process
+        try:
+            epoch, v = str(token).split("-")
+            v = int(v)
+        except (TypeError, ValueError):
+            return None
+        return v if epoch == self.epoch and v <= self.version else None
+
+    def token(self, version):
+        return f"{self.epoch}-{version}"
+
+    def changes(self, since):
+        # (version, changed shows or None for all, removed shows, settings changed, status changed)
+        with self.cond:
+            if since is None:
+                return self.version, None, [], True, True
+            return (self.version,
+                    {n for n,v in self.shows.items() if v > since},
+                    [n for n,v in self.removed.items() if v > since],
+                    self.settings > since, self.status > since)
+
+    def wait(self, since, timeout):
+        # True once there is something newer than since
+        with self.cond:
+            return self.cond.wait_for(lambda: since is None or self.version > since, timeout)
+
+STATE = StateVersions()
+
 # ---------------- DB helpers ----------------
+# WAL journal: readers work on a snapshot and never wait for the writer. writes are
+# serialized by DB_WRITE_LOCK and each runs as one explicit transaction (db_transaction)
+def db_connect():
+    conn = sqlite3.connect(DB_FILE, timeout=10, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # NORMAL is durable across app crashes in WAL mode; only a power cut can drop the last commits
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+class DBPool:
+    # small pool of connections, each used by one thread at a time
+    def __init__(self, size=DB_POOL_SIZE):
+        self.size = size
+        self.idle = queue.LifoQueue()
+
+    @contextlib.contextmanager
+    def connection(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            conn = db_connect()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction: conn.rollback()
+            if self.idle.qsize() < self.size: self.idle.put(conn)
+            else: conn.close()
+
+DB_POOL = DBPool()
+DB_WRITE_LOCK = threading.Lock()
+
+def db_read(sql, params=()):
+    with DB_POOL.connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+@contextlib.contextmanager
+def db_transaction():
+    # one write transaction: commits on success, rolls back on error
+    t = time.perf_counter()
+    with DB_WRITE_LOCK, DB_POOL.connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        M_DB_LOCK_WAIT.observe(time.perf_counter() - t)
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            M_DB_TX.inc("rollback")
+            raise
+        with M_DB_COMMIT.time():
+            conn.execute("COMMIT")
+        M_DB_TX.inc("commit")
+
+# resume positions are stored in milliseconds (shows.position_ms); "HH:MM:SS" is for display
+def _ts_ms(ts):
+    try:
+        h,m,s = map(int, (ts or "").split(":"))
+    except ValueError:
+        return 0
+    return (h*3600 + m*60 + s) * 1000
+
+def _fmt_ms(ms):
+    s = (ms or 0) // 1000
+    return f"{s//3600:02d}:{s//60 % 60:02d}:{s % 60:02d}"
+
+SHOWS_TABLE = """CREATE TABLE shows (
+    id INTEGER PRIMARY KEY,
+    frame TEXT NOT NULL,
+    name TEXT,
+    order_idx INTEGER,
+    episode_index INTEGER DEFAULT 0,
+    position_ms INTEGER DEFAULT 0,
+    UNIQUE(frame, name)
+)"""
+
 def init_db():
     need = not os.path.exists(DB_FILE)
-    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+    conn = db_connect()
+    conn.create_function("ts_ms", 1, _ts_ms)
     cur = conn.cursor()
+    cur.execute("BEGIN")
+    cols = [] if need else [r[1] for r in cur.execute("PRAGMA table_info(shows)")]
     if need:
-        cur.execute("""CREATE TABLE shows (
-            id INTEGER PRIMARY KEY,
-            name TEXT UNIQUE,
-            order_idx INTEGER,
-            episode_index INTEGER DEFAULT 0,
-            timestamp TEXT DEFAULT '00:00:00'
-        )""")
+        cur.execute(SHOWS_TABLE)
         cur.execute("""CREATE TABLE settings (
             key TEXT PRIMARY KEY,
             value TEXT
@@ -143,385 +583,1889 @@ def init_db():
         cur.execute("INSERT INTO settings(key,value) VALUES(?,?)", ("schedule_enabled","0"))
         cur.execute("INSERT INTO settings(key,value) VALUES(?,?)", ("schedule_start","08:00"))
         cur.execute("INSERT INTO settings(key,value) VALUES(?,?)", ("schedule_end","23:00"))
-        conn.commit()
-    return conn
+    # one playlist per frame (added later): older DBs get the frame column, their rows going to
+    # the first frame
+    elif "frame" not in cols:
+        cur.execute("ALTER TABLE shows RENAME TO shows_old")
+        cur.execute(SHOWS_TABLE)
+        cur.execute("""INSERT INTO shows(id,frame,name,order_idx,episode_index,position_ms)
+                       SELECT id,?,name,order_idx,episode_index,ts_ms(timestamp) FROM shows_old""", (FRAMES_CONFIG[0]["name"],))
+        cur.execute("DROP TABLE shows_old")
+    # millisecond positions (added later): converted from the old whole-second timestamp column,
+    # which is left in place but no longer used
+    elif "position_ms" not in cols:
+        cur.execute("ALTER TABLE shows ADD COLUMN position_ms INTEGER DEFAULT 0")
+        cur.execute("UPDATE shows SET position_ms=ts_ms(timestamp)")
+    # library snapshot (added later, so also created on existing DBs)
+    cur.execute("""CREATE TABLE IF NOT EXISTS episodes (
+        show TEXT,
+        path TEXT,
+        sort_key TEXT,
+        size INTEGER,
+        mtime INTEGER,
+        PRIMARY KEY(show, path)
+    )""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS library_dirs (
+        show TEXT,
+        path TEXT,
+        mtime INTEGER,
+        PRIMARY KEY(show, path)
+    )""")
+    # ffprobe results; only valid while the file still has this size and mtime
+    cur.execute("""CREATE TABLE IF NOT EXISTS probes (
+        path TEXT PRIMARY KEY,
+        size INTEGER,
+        mtime INTEGER,
+        duration_ms INTEGER,
+        streams TEXT
+    )""")
+    cur.execute("COMMIT")
+    conn.close()
+
+init_db()
+
+def db_all_shows(frame=None):
+    # one frame's playlist (default: the first frame); progress not yet flushed by the journal
+    # wins over the stored one
+    frame = frame or FRAMES[0]
+    rows = db_read("SELECT name,order_idx,episode_index,position_ms FROM shows WHERE frame=? ORDER BY order_idx", (frame.name,))
+    return frame.progress.overlay(rows)
+
+class PlayQueue:
+    # play order, held in memory as sorted (key, name) pairs and persisted as sparse integer keys
+    # in shows.order_idx. rotate/move to front/move to a position find their spot by bisect and
+    # write a single row; all keys are renumbered (one transaction) only when two neighbours run
+    # out of room between them or keys drift past KEY_LIMIT
+    GAP = 1 << 10
+    KEY_LIMIT = 1 << 40
 
-DB = init_db()
-DB_LOCK = threading.Lock()
+    def __init__(self, frame):
+        self.frame = frame      # frame name; each frame has its own queue
+        self.lock = threading.RLock()
+        self._keys = None       # sorted keys
+        self._names = []        # names, same order as _keys
+        self._key = {}          # name -> key
 
-def db_all_shows():
-    with DB_LOCK:
-        cur = DB.cursor()
-        cur.execute("SELECT name,order_idx,episode_index,timestamp FROM shows ORDER BY order_idx")
-        return cur.fetchall()
+    def _ensure(self):
+        # call with self.lock held
+        if self._keys is not None: return
+        rows = db_read("SELECT name,order_idx FROM shows WHERE frame=? ORDER BY order_idx, id", (self.frame,))
+        self._names = [n for n,_ in rows]
+        self._keys = [k for _,k in rows]
+        self._key = dict(rows)
+        # old DBs can have duplicate or NULL keys (the old rotation rewrote every row)
+        if any(k is None for k in self._keys) or any(a >= b for a,b in zip(self._keys, self._keys[1:])):
+            self._renumber(self._names)
+
+    def _renumber(self, names, also=()):
+        # call with self.lock held
+        self._names = list(names)
+        self._keys = [(i+1)*self.GAP for i in range(len(names))]
+        self._key = dict(zip(self._names, self._keys))
+        with db_transaction() as conn:
+            conn.executemany("UPDATE shows SET order_idx=? WHERE frame=? AND name=?",
+                             [(k, self.frame, n) for k,n in zip(self._keys, self._names)])
+            for sql,params in also: conn.execute(sql, params)
+        STATE.touch(shows=self._names)
+
+    def names(self):
+        with self.lock:
+            self._ensure()
+            return list(self._names)
+
+    def head(self):
+        with self.lock:
+            self._ensure()
+            return self._names[0] if self._names else None
+
+    def position(self, name):
+        with self.lock:
+            self._ensure()
+            k = self._key.get(name)
+            return None if k is None else bisect.bisect_left(self._keys, k)
+
+    def add(self, names):
+        # append shows not yet in the playlist, in one transaction; returns the names added
+        with self.lock:
+            self._ensure()
+            new = list(dict.fromkeys(n for n in names if n not in self._key))
+            if not new: return []
+            last = self._keys[-1] if self._keys else 0
+            keys = [last + (i+1)*self.GAP for i in range(len(new))]
+            with db_transaction() as conn:
+                conn.executemany("INSERT OR IGNORE INTO shows(frame,name,order_idx) VALUES(?,?,?)",
+                                 [(self.frame, n, k) for n,k in zip(new, keys)])
+            self._names += new
+            self._keys += keys
+            self._key.update(zip(new, keys))
+        STATE.touch(shows=new)
+        return new
+
+    def remove(self, name):
+        with self.lock:
+            self._ensure()
+            with db_transaction() as conn:
+                conn.execute("DELETE FROM shows WHERE frame=? AND name=?", (self.frame, name))
+            k = self._key.pop(name, None)
+            if k is not None:
+                i = bisect.bisect_left(self._keys, k)
+                del self._keys[i], self._names[i]
+        STATE.touch(removed=[name])
+
+    def move_to(self, name, pos, also=()):
+        # move name to index pos (clamped); `also` = extra (sql, params) for the same transaction
+        with self.lock:
+            self._ensure()
+            k = self._key.get(name)
+            if k is None: return False
+            i = bisect.bisect_left(self._keys, k)
+            del self._keys[i], self._names[i]
+            pos = max(0, min(pos, len(self._names)))
+            lo = self._keys[pos-1] if pos > 0 else None
+            hi = self._keys[pos] if pos < len(self._keys) else None
+            if lo is None and hi is None: key = self.GAP
+            elif lo is None: key = hi - self.GAP
+            elif hi is None: key = lo + self.GAP
+            else: key = (lo + hi) // 2
+            if key == lo or key == hi or abs(key) > self.KEY_LIMIT:
+                self._renumber(self._names[:pos] + [name] + self._names[pos:], also)
+                return True
+            self._keys.insert(pos, key)
+            self._names.insert(pos, name)
+            self._key[name] = key
+            with db_transaction() as conn:
+                conn.execute("UPDATE shows SET order_idx=? WHERE frame=? AND name=?", (key, self.frame, name))
+                for sql,params in also: conn.execute(sql, params)
+        STATE.touch(shows=[name])
+        return True
+
+    def move_to_front(self, name, also=()):
+        return self.move_to(name, 0, also)
+
+    def rotate(self, name, also=()):
+        # send name to the back of the queue (round-robin)
+        return self.move_to(name, sys.maxsize, also)
+
+    def reorder(self, names):
+        # bulk reorder in one transaction: listed shows first, in that order, then the rest
+        # keeping their relative order; unknown names are ignored
+        with self.lock:
+            self._ensure()
+            listed = [n for n in dict.fromkeys(names) if n in self._key]
+            seen = set(listed)
+            self._renumber(listed + [n for n in self._names if n not in seen])
+            return list(self._names)
+
+def db_add_shows(names):
+    # append shows not yet in each frame's playlist; returns the names added to any of them
+    return list(dict.fromkeys(n for f in FRAMES for n in f.queue.add(names)))
 
 def db_add_show(name):
-    with DB_LOCK:
-        cur = DB.cursor()
-        # compute next order_idx
-        cur.execute("SELECT COALESCE(MAX(order_idx),-1)+1 FROM shows")
-        order_idx = cur.fetchone()[0]
-        cur.execute("INSERT OR IGNORE INTO shows(name,order_idx) VALUES(?,?)", (name,order_idx))
-        DB.commit()
-
-def db_remove_show(name):
-    with DB_LOCK:
-        cur = DB.cursor()
-        cur.execute("DELETE FROM shows WHERE name=?", (name,))
-        DB.commit()
-
-def db_get_setting(key):
-    with DB_LOCK:
-        cur = DB.cursor()
-        cur.execute("SELECT value FROM settings WHERE key=?", (key,))
-        r = cur.fetchone()
-        return r[0] if r else None
-
-def db_set_setting(key,val):
-    with DB_LOCK:
-        cur = DB.cursor()
-        cur.execute("INSERT OR REPLACE INTO settings(key,value) VALUES(?,?)", (key,str(val)))
-        DB.commit()
-
-def db_update_progress(name, ep_index, timestamp_str):
-    with DB_LOCK:
-        cur = DB.cursor()
-        cur.execute("UPDATE shows SET episode_index=?, timestamp=? WHERE name=?", (ep_index, timestamp_str, name))
-        DB.commit()
-
-def db_get_next_index(current_idx):
-    with DB_LOCK:
-        cur = DB.cursor()
-        cur.execute("SELECT COUNT(*) FROM shows")
-        c = cur.fetchone()[0]
-        return (current_idx + 1) % c if c else 0
+    db_add_shows([name])
+
+def db_remove_show(name, frame=None):
+    # from one frame's playlist, or from all of them
+    for f in [frame] if frame else FRAMES:
+        f.queue.remove(name)
+
+class SettingsStore:
+    # the settings table, loaded into memory on first use. reads never touch SQLite; update()
+    # writes through in one transaction and tells the listeners what changed
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._values = None
+        self.listeners = []     # callables(changed keys), e.g. to wake the playback thread
+
+    def _load(self):
+        return dict(db_read("SELECT key,value FROM settings"))
+
+    def get(self, key, default=None):
+        if self._values is None:
+            with self.lock:
+                if self._values is None: self._values = self._load()
+        return self._values.get(key, default)
+
+    def update(self, values):
+        values = {k: str(v) for k,v in values.items()}
+        self.get(None)
+        with self.lock:
+            changed = [k for k,v in values.items() if self._values.get(k) != v]
+            if not changed: return []
+            with db_transaction() as conn:
+                conn.executemany("INSERT OR REPLACE INTO settings(key,value) VALUES(?,?)", [(k, values[k]) for k in changed])
+            self._values = {**self._values, **{k: values[k] for k in changed}}
+        # frame settings are stored as "<frame>/<key>"
+        is_setting = lambda k: k.rpartition("/")[2] in SETTING_KEYS
+        STATE.touch(settings=any(map(is_setting, changed)), status=not all(map(is_setting, changed)))
+        for fn in self.listeners:
+            fn(changed)
+        return changed
+
+SETTINGS = SettingsStore()
+
+class ProgressJournal:
+    # write-behind buffer for playback progress. record() only updates memory (repeated updates
+    # of a show coalesce); everything pending is written in one transaction once `interval` sec
+    # have passed since the last flush, or right away by flush()
+    def __init__(self, frame, interval=PROGRESS_FLUSH):
+        self.frame = frame      # frame name
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pending = {}       # name -> (episode_index, position_ms)
+        self.last_flush = time.monotonic()
+        self.stats = {"recorded": 0, "coalesced": 0, "flushes": 0, "rows_written": 0}
+
+    def record(self, name, ep_index, position_ms):
+        with self.lock:
+            if name in self.pending: self.stats["coalesced"] += 1
+            self.pending[name] = (ep_index, position_ms)
+            self.stats["recorded"] += 1
+            due = time.monotonic() - self.last_flush >= self.interval
+        STATE.touch(shows=[name])
+        if due: self.flush()
+
+    def due_in(self):
+        # sec until the next flush is due (<= 0: it is)
+        return self.last_flush + self.interval - time.monotonic()
+
+    def discard(self, name):
+        # forget pending progress, e.g. before the show's episode/position is reset
+        with self.lock:
+            self.pending.pop(name, None)
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, {}
+            self.last_flush = time.monotonic()
+        if not batch: return 0
+        try:
+            with db_transaction() as conn:
+                conn.executemany("UPDATE shows SET episode_index=?, position_ms=? WHERE frame=? AND name=?",
+                                 [(ep, ms, self.frame, name) for name,(ep,ms) in batch.items()])
+        except Exception:
+            # keep it for the next flush unless newer progress arrived meanwhile
+            with self.lock:
+                self.pending = {**batch, **self.pending}
+            raise
+        with self.lock:
+            self.stats["flushes"] += 1
+            self.stats["rows_written"] += len(batch)
+        return len(batch)
+
+    def overlay(self, rows):
+        # apply pending progress to (name, order_idx, episode_index, position_ms) rows
+        with self.lock:
+            if not self.pending: return rows
+            pending = dict(self.pending)
+        return [(n, o) + pending[n] if n in pending else (n, o, e, t) for n,o,e,t in rows]
+
+def db_update_progress(frame, name, ep_index, position_ms):
+    # forced save (pause, cutoff, shutdown): record and write everything pending now
+    frame.progress.record(name, ep_index, position_ms)
+    frame.progress.flush()
+
+def db_load_library():
+    with DB_POOL.connection() as conn:
+        # one read transaction so both tables come from the same snapshot
+        conn.execute("BEGIN")
+        dirs = conn.execute("SELECT show,path,mtime FROM library_dirs").fetchall()
+        eps = conn.execute("SELECT show,path,size,mtime FROM episodes").fetchall()
+        conn.execute("COMMIT")
+        return dirs, eps
+
+def db_save_library_show(show, dirs, upserts, removed):
+    # dirs: [(relpath, mtime)] for the whole show, upserts: [(relpath, size, mtime)], removed: [relpath]
+    # sort_key is the relative path, which keeps the old full-path sort order
+    with db_transaction() as conn:
+        conn.execute("DELETE FROM library_dirs WHERE show=?", (show,))
+        conn.executemany("INSERT INTO library_dirs(show,path,mtime) VALUES(?,?,?)", [(show,r,m) for r,m in dirs])
+        conn.executemany("DELETE FROM episodes WHERE show=? AND path=?", [(show,r) for r in removed])
+        conn.executemany("DELETE FROM probes WHERE path=?", [(os.path.join(show, r),) for r in removed])
+        conn.executemany("INSERT OR REPLACE INTO episodes(show,path,sort_key,size,mtime) VALUES(?,?,?,?,?)",
+                         [(show,r,r,sz,m) for r,sz,m in upserts])
+
+def db_forget_library_show(show):
+    with db_transaction() as conn:
+        conn.execute("DELETE FROM library_dirs WHERE show=?", (show,))
+        conn.execute("DELETE FROM episodes WHERE show=?", (show,))
+        # probes paths are relative to ANIME_DIR: everything under "<show>/"
+        conn.execute("DELETE FROM probes WHERE path >= ? AND path < ?", (show + os.sep, show + chr(ord(os.sep) + 1)))
 
 # ---------------- Utilities ----------------
-def kodi_rpc(method, params=None):
-    payload = {"jsonrpc":"2.0","id":1,"method":method}
-    if params is not None: payload["params"] = params
-    try:
-        r = requests.post(KODI_URL, json=payload, auth=KODI_AUTH, timeout=4)
-        return r.json()
-    except Exception:
-        return {}
-
-def kodi_get_active_player():
-    r = kodi_rpc("Player.GetActivePlayers")
-    return r.get("result", [])
-
-def kodi_get_time():
-    players = kodi_get_active_player()
-    if not players: return "00:00:00"
-    pid = players[0]["playerid"]
-    res = kodi_rpc("Player.GetProperties", {"playerid": pid, "properties":["time","percentage"]})
-    time_info = res.get("result", {}).get("time", {"hours":0,"minutes":0,"seconds":0})
-    h,m,s = time_info.get("hours",0), time_info.get("minutes",0), time_info.get("seconds",0)
-    return f"{h:02d}:{m:02d}:{s:02d}"
-
-def kodi_open_and_seek(path, timestamp_str):
-    # open then seek
-    kodi_rpc("Player.Open", {"item": {"file": path}})
-    # simple sleep then seek (Kodi needs small time to open)
-    time.sleep(1.2)
-    players = kodi_get_active_player()
-    if not players: return
-    pid = players[0]["playerid"]
-    # build value object
-    h,m,s = map(int, timestamp_str.split(":"))
-    kodi_rpc("Player.Seek", {"playerid": pid, "value": {"hours":h,"minutes":m,"seconds":s}})
-
-def kodi_pause():
-    players = kodi_get_active_player()
-    if not players: return
-    pid = players[0]["playerid"]
-    kodi_rpc("Player.PlayPause", {"playerid": pid, "play": False})
+class KodiClient:
+    # Kodi JSON-RPC over one persistent HTTP session (keep-alive). batch() sends several calls
+    # in a single request, and the active player id is cached between calls.
+    # circuit breaker: KODI_BREAKER_FAILURES failed requests in a row mark Kodi down (one slow
+    # answer on a busy box doesn't); from then on calls fail fast
+    # (return {} / None without touching the network) while a background thread pings Kodi
+    # with backoff until it answers again. each frame has its own client, whose `events` is that
+    # Kodi's notification stream
+    def __init__(self, url, auth=None, timeout=4, probe=(KODI_PROBE_MIN, KODI_PROBE_MAX), name="default"):
+        self.name = name        # frame name, for the metrics
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = auth
+        self.player_id = None
+        self.probe = probe
+        self.lock = threading.Lock()
+        self.up = True          # optimistic until a request fails
+        self.changed = time.time()
+        self.last_error = None
+        self.failures = 0       # failed probes since Kodi went down
+        self.errors = 0         # failed requests in a row while up
+        self.wake = threading.Event()   # set to probe right away (e.g. notifications reconnected)
+        self.listeners = []     # callables(up), run when Kodi goes down or comes back
+        self.events = None      # KodiEvents
+
+    def _send(self, payload, timeout):
+        r = self.session.post(self.url, json=payload, timeout=timeout)
+        try:
+            return r.json()
+        except ValueError:
+            return None
+
+    def _post(self, payload):
+        calls = payload if isinstance(payload, list) else [payload]
+        if not self.up:
+            for c in calls: M_KODI_CALLS.inc(self.name, c["method"], "skipped")
+            return None
+        t = time.perf_counter()
+        try:
+            r = self._send(payload, self.timeout)
+        except requests.RequestException as e:
+            for c in calls: M_KODI_CALLS.inc(self.name, c["method"], "failed")
+            with self.lock:
+                self.errors += 1
+                trip = self.errors >= KODI_BREAKER_FAILURES
+            if trip: self._set_up(False, e)
+            return None
+        finally:
+            M_KODI_SECONDS.observe(time.perf_counter() - t, self.name, "+".join(c["method"] for c in calls))
+        self.errors = 0
+        errors = {x.get("id") for x in (r if isinstance(r, list) else [r]) if isinstance(x, dict) and "error" in x}
+        for c in calls: M_KODI_CALLS.inc(self.name, c["method"], "error" if c["id"] in errors else "ok")
+        return r
+
+    def _set_up(self, up, error=None):
+        with self.lock:
+            if self.up == up: return
+            self.up, self.changed, self.failures, self.errors = up, time.time(), 0, 0
+            if not up:
+                self.last_error = f"{type(error).__name__}: {error}"
+                self.player_id = None
+                threading.Thread(target=self._probe_loop, daemon=True).start()
+        for fn in self.listeners:
+            try:
+                fn(up)
+            except Exception:
+                pass
+
+    def _probe_loop(self):
+        backoff = self.probe[0]
+        while running and not self.up:
+            self.wake.wait(backoff)
+            self.wake.clear()
+            try:
+                if self._send(self._req("JSONRPC.Ping", None, 1), self.timeout):
+                    self._set_up(True)
+                    return
+            except requests.RequestException as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+            self.failures += 1
+            backoff = min(backoff*2, self.probe[1])
+
+    def health(self):
+        return {"up": self.up, "since": int(self.changed), "error": None if self.up else self.last_error,
+                "failed_probes": self.failures}
+
+    @staticmethod
+    def _req(method, params, rid):
+        payload = {"jsonrpc":"2.0","id":rid,"method":method}
+        if params is not None: payload["params"] = params
+        return payload
+
+    def call(self, method, params=None):
+        r = self._post(self._req(method, params, 1))
+        return r if isinstance(r, dict) else {}
+
+    def batch(self, calls):
+        # calls: [(method, params)]; responses come back in the same order ({} if missing)
+        r = self._post([self._req(m, p, i) for i,(m,p) in enumerate(calls)])
+        by_id = {x.get("id"): x for x in r if isinstance(x, dict)} if isinstance(r, list) else {}
+        return [by_id.get(i, {}) for i in range(len(calls))]
+
+    def active_players(self):
+        players = self.call("Player.GetActivePlayers").get("result", [])
+        self.player_id = players[0]["playerid"] if players else None
+        return players
+
+    def status(self, properties=("time","percentage"), item=False, _retry=True):
+        # active players, player properties (and the playing file) in one round trip, using
+        # the cached player id (1 = video player); only re-asks if that id was stale.
+        # returns None when nothing is playing
+        pid = self.player_id if self.player_id is not None else 1
+        calls = [("Player.GetActivePlayers", None),
+                 ("Player.GetProperties", {"playerid": pid, "properties": list(properties)})]
+        if item: calls.append(("Player.GetItem", {"playerid": pid, "properties": ["file"]}))
+        res = self.batch(calls)
+        players = res[0].get("result") or []
+        if not players:
+            return None
+        if players[0]["playerid"] != pid:
+            self.player_id = players[0]["playerid"]
+            return self.status(properties, item, False) if _retry else None
+        self.player_id = pid
+        out = dict(res[1].get("result") or {})
+        out["playerid"] = pid
+        if item: out["file"] = res[2].get("result", {}).get("item", {}).get("file")
+        return out
+
+    def now_playing(self):
+        # (file, position in ms) of the active player in one request, or (None, None)
+        st = self.status(item=True)
+        if not st: return None, None
+        return st.get("file"), _kodi_ms(st.get("time"))
+
+    def wait_ready(self, since, timeout=KODI_START_TIMEOUT):
+        # player id once Kodi has actually started the stream, or None. uses Player.OnAVStart when
+        # notifications are connected, else polls until the player reports a total time
+        deadline = time.monotonic() + timeout
+        if self.events.connected:
+            ev = self.events.wait_for(("Player.OnAVStart",), since, timeout)
+            if ev: return ev[2].get("player", {}).get("playerid", self.player_id)
+        while time.monotonic() < deadline and self.up:
+            st = self.status(properties=("totaltime",))
+            if st and _kodi_secs(st.get("totaltime")): return st["playerid"]
+            time.sleep(0.25)
+        return None
+
+    def seek(self, pid, position_ms):
+        if not position_ms: return
+        # build value object
+        s, ms = divmod(position_ms, 1000)
+        self.call("Player.Seek", {"playerid": pid, "value": {"hours":s//3600,"minutes":s//60 % 60,"seconds":s % 60,"milliseconds":ms}})
+
+    def play_queue(self, path, position_ms, next_path=None):
+        # play path through the video playlist with next_path queued behind, so Kodi rolls
+        # straight into it when path ends (one request: clear, add, add, open), then seek as
+        # soon as the player is ready
+        since = self.events.seq
+        calls = [("Playlist.Clear", {"playlistid": KODI_PLAYLIST}),
+                 ("Playlist.Add", {"playlistid": KODI_PLAYLIST, "item": {"file": path}})]
+        if next_path: calls.append(("Playlist.Add", {"playlistid": KODI_PLAYLIST, "item": {"file": next_path}}))
+        calls.append(("Player.Open", {"item": {"playlistid": KODI_PLAYLIST, "position": 0}}))
+        self.batch(calls)
+        pid = self.wait_ready(since)
+        if pid is not None: self.seek(pid, position_ms)
+
+    def queue_next(self, next_path, remove):
+        # the playlist is kept as [playing, next]: drop the entry at position remove (the finished
+        # one after a transition, or a stale next after a reorder) and queue next_path
+        calls = [("Playlist.Remove", {"playlistid": KODI_PLAYLIST, "position": remove})]
+        if next_path: calls.append(("Playlist.Add", {"playlistid": KODI_PLAYLIST, "item": {"file": next_path}}))
+        self.batch(calls)
+
+    def pause(self):
+        # try the cached player id first; only look it up if unknown or stale
+        if self.player_id is not None:
+            if "result" in self.call("Player.PlayPause", {"playerid": self.player_id, "play": False}): return
+        players = self.active_players()
+        if not players: return
+        self.call("Player.PlayPause", {"playerid": players[0]["playerid"], "play": False})
+
+def _kodi_secs(t):
+    t = t or {}
+    return t.get("hours",0)*3600 + t.get("minutes",0)*60 + t.get("seconds",0)
+
+def _kodi_ms(t):
+    return _kodi_secs(t)*1000 + (t or {}).get("milliseconds",0)
+
+class KodiEvents:
+    # optional subscriber to Kodi's notification stream (raw JSON-RPC over TCP, port 9090).
+    # notifications are numbered; wait_for() blocks until a given one arrives
+    def __init__(self, host, port, kodi=None, history=64):
+        self.host = host
+        self.port = port
+        self.kodi = kodi        # the KodiClient of the same Kodi
+        self.cond = threading.Condition()
+        self.connected = False
+        self.seq = 0
+        self.history = collections.deque(maxlen=history)    # (seq, method, data)
+        self.listeners = []     # callables(method, data), run on the reader thread
+        self.connection_listeners = []  # callables(connected), run when the socket connects or drops
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        backoff = 1
+        while running:
+            try:
+                with socket.create_connection((self.host, self.port), timeout=5) as sock:
+                    sock.settimeout(None)
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                    self._set_connected(True)
+                    backoff = 1
+                    self._read(sock)
+            except OSError:
+                pass
+            self._set_connected(False)
+            time.sleep(backoff)
+            backoff = min(backoff*2, 30)
+
+    def _read(self, sock):
+        # Kodi sends back-to-back JSON objects with no framing
+        dec, utf8, buf = json.JSONDecoder(), codecs.getincrementaldecoder("utf-8")("replace"), ""
+        while True:
+            data = sock.recv(65536)
+            if not data: return
+            buf += utf8.decode(data)
+            while True:
+                buf = buf.lstrip()
+                try:
+                    obj, end = dec.raw_decode(buf)
+                except ValueError:
+                    break
+                buf = buf[end:]
+                if isinstance(obj, dict) and "method" in obj and "id" not in obj:
+                    self._dispatch(obj["method"], (obj.get("params") or {}).get("data") or {})
+
+    def _set_connected(self, state):
+        with self.cond:
+            changed, self.connected = self.connected != state, state
+            self.cond.notify_all()
+        # the notification socket coming back means Kodi is probably up again
+        if state and self.kodi: self.kodi.wake.set()
+        if changed:
+            for fn in self.connection_listeners:
+                fn(state)
+
+    def _dispatch(self, method, data):
+        with self.cond:
+            self.seq += 1
+            self.history.append((self.seq, method, data))
+            self.cond.notify_all()
+        for fn in self.listeners:
+            try:
+                fn(method, data)
+            except Exception:
+                pass
+
+    def wait_for(self, methods, since, timeout):
+        # first notification in methods numbered after since, as (seq, method, data); None on
+        # timeout. works (as a plain sleep) while disconnected
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                for ev in self.history:
+                    if ev[0] > since and ev[1] in methods: return ev
+                left = deadline - time.monotonic()
+                if left <= 0: return None
+                self.cond.wait(left)
 
 # ---------------- Episode discovery & thumbnails ----------------
 VIDEO_EXTS = (".mp4",".mkv",".m4v",".webm",".avi")
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+class LibraryIndex:
+    # in-memory sorted episode lists per show, persisted to the episodes/library_dirs tables.
+    # a show is only looked at again when the mtime of one of its folders changed (checked at
+    # most every LIBRARY_RECHECK sec), and then only the changed folders are re-listed
+    def __init__(self, root, recheck=LIBRARY_RECHECK):
+        self.root = root
+        self.recheck = recheck
+        self.lock = threading.Lock()
+        self._shows = None      # (root mtime, sorted show names, checked at)
+        self._entries = {}      # show -> {"tree": {dir: (mtime, [subdirs], {file: (size, mtime)})}, "videos": [...], "checked": ts}
+        self._paths = {}        # episode path -> (show, episode index), kept in step with _entries
+        self.listeners = []     # callables(show), run after a show's folders were (re)listed
+
+    def _set_entry(self, show, entry):
+        # call with self.lock held
+        self._drop_entry(show)
+        self._entries[show] = entry
+        for i,p in enumerate(entry["videos"]):
+            self._paths[p] = (show, i)
+
+    def _drop_entry(self, show):
+        # call with self.lock held
+        old = self._entries.pop(show, None)
+        if old:
+            for p in old["videos"]:
+                if self._paths.get(p, (None,))[0] == show: del self._paths[p]
+
+    def load(self):
+        # restore the last snapshot from the DB; entries are verified against disk on first use
+        dirs, eps = db_load_library()
+        trees = {}
+        for show,rel,m in dirs:
+            d = os.path.normpath(os.path.join(self.root, show, rel))
+            trees.setdefault(show, {})[d] = (m, [], {})
+        for show,tree in trees.items():
+            top = os.path.join(self.root, show)
+            for d in tree:
+                if d != top and os.path.dirname(d) in tree:
+                    tree[os.path.dirname(d)][1].append(d)
+        for show,rel,size,m in eps:
+            p = os.path.join(self.root, show, rel)
+            t = trees.get(show, {}).get(os.path.dirname(p))
+            if t is not None: t[2][p] = (size, m)
+        with self.lock:
+            for show,tree in trees.items():
+                files = [p for t in tree.values() for p in t[2]]
+                self._set_entry(show, {"tree": tree, "videos": sorted(files), "checked": 0})
+
+    def _scan_show(self, show, old=None, full=False):
+        # returns (entry, added, removed); folders whose mtime is unchanged reuse the old listing
+        t = time.perf_counter()
+        old_tree = old["tree"] if old else {}
+        tree, changed, stack = {}, [], [os.path.join(self.root, show)]
+        while stack:
+            d = stack.pop()
+            # stat before listing so a file added mid-scan still invalidates the entry
+            m = _mtime(d)
+            prev = old_tree.get(d)
+            if prev and not full and m is not None and prev[0] == m:
+                tree[d] = prev
+                stack.extend(prev[1])
+                continue
+            subdirs, files = [], {}
+            try:
+                entries = list(os.scandir(d))
+            except OSError:
+                entries = []
+            for e in entries:
+                try:
+                    if e.is_dir():
+                        # same as os.walk: symlinked dirs are not followed
+                        if not e.is_symlink(): subdirs.append(e.path)
+                    elif e.name.lower().endswith(VIDEO_EXTS):
+                        st = e.stat()
+                        files[e.path] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    continue
+            tree[d] = (m, subdirs, files)
+            changed.append(d)
+            stack.extend(subdirs)
+        old_files = {p for t in old_tree.values() for p in t[2]}
+        new_files = {p for t in tree.values() for p in t[2]}
+        added, removed = sorted(new_files - old_files), sorted(old_files - new_files)
+        M_SCAN_DIRS.inc(n=len(changed))
+        if changed:
+            top = os.path.join(self.root, show)
+            rel = lambda p: os.path.relpath(p, top)
+            db_save_library_show(show,
+                [(rel(d), t[0]) for d,t in tree.items()],
+                [(rel(p), sz, fm) for d in changed for p,(sz,fm) in tree[d][2].items()],
+                [rel(p) for p in removed])
+        entry = {"tree": tree, "videos": sorted(new_files), "checked": time.monotonic()}
+        with self.lock:
+            self._set_entry(show, entry)
+        if added or removed: STATE.touch(shows=[show])
+        M_SCAN_SECONDS.observe(time.perf_counter() - t, "full" if full or not old else "incremental")
+        if changed:
+            for fn in self.listeners:
+                fn(show)
+        return entry, added, removed
+
+    def _stale(self, entry):
+        return any(_mtime(d) != t[0] for d,t in entry["tree"].items())
+
+    def videos(self, show):
+        now = time.monotonic()
+        with self.lock:
+            entry = self._entries.get(show)
+            if entry and now - entry["checked"] < self.recheck:
+                return entry["videos"]
+        if entry and not self._stale(entry):
+            entry["checked"] = now
+            return entry["videos"]
+        return self._scan_show(show, entry)[0]["videos"]
+
+    def files(self, show):
+        # [(path, size, mtime)] of the show's episodes, in episode order
+        videos = self.videos(show)
+        out = []
+        with self.lock:
+            tree = (self._entries.get(show) or {}).get("tree", {})
+            for p in videos:
+                st = tree.get(os.path.dirname(p), (None, None, {}))[2].get(p)
+                out.append((p, st[0], st[1]) if st else (p, None, None))
+        return out
+
+    def shows(self, force=False):
+        now = time.monotonic()
+        with self.lock:
+            cached = self._shows
+        if cached and not force:
+            if now - cached[2] < self.recheck: return cached[1]
+            if _mtime(self.root) == cached[0]:
+                with self.lock: self._shows = (cached[0], cached[1], now)
+                return cached[1]
+        m = _mtime(self.root)
+        names = sorted([d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root,d))])
+        with self.lock:
+            self._shows = (m, names, now)
+        return names
+
+    def sync(self, full=False):
+        # check every show against disk now, rescanning changed folders (or everything if full);
+        # returns the diff against the previous snapshot
+        with self.lock:
+            known = dict(self._entries)
+        names = self.shows(force=True)
+        diff = {"added_shows": sorted(set(names) - set(known)),
+                "removed_shows": sorted(set(known) - set(names)),
+                "added_episodes": {}, "removed_episodes": {}}
+        for show in diff["removed_shows"]:
+            with self.lock:
+                self._drop_entry(show)
+            db_forget_library_show(show)
+        for show in names:
+            old = known.get(show)
+            if old and not full and not self._stale(old):
+                old["checked"] = time.monotonic()
+                continue
+            _, added, removed = self._scan_show(show, old, full)
+            top = os.path.join(self.root, show)
+            if added: diff["added_episodes"][show] = [os.path.relpath(p, top) for p in added]
+            if removed: diff["removed_episodes"][show] = [os.path.relpath(p, top) for p in removed]
+        return diff
+
+    def locate(self, path):
+        # (show, episode index) for a file Kodi reports as playing, or None if it isn't under
+        # ANIME_DIR. a file in a known show folder that isn't indexed (yet) maps to episode 0
+        with self.lock:
+            hit = self._paths.get(path)
+        if hit: return hit
+        path = os.path.abspath(path)
+        rel = os.path.relpath(path, os.path.abspath(self.root))
+        show = rel.split(os.sep, 1)[0]
+        if rel.startswith(os.pardir) or show in (os.curdir, "") or not os.path.isdir(os.path.join(self.root, show)):
+            return None
+        self.videos(show)   # index it if needed
+        with self.lock:
+            hit = self._paths.get(path) or self._paths.get(os.path.join(self.root, rel))
+        return hit or (show, 0)
+
+LIBRARY = LibraryIndex(ANIME_DIR)
+
 def list_shows_on_disk():
-    return sorted([d for d in os.listdir(ANIME_DIR) if os.path.isdir(os.path.join(ANIME_DIR,d))])
+    return LIBRARY.shows()
 
 def build_video_list(show):
-    files=[]
-    for root,_,fs in os.walk(os.path.join(ANIME_DIR,show)):
-        for f in fs:
-            if f.lower().endswith(VIDEO_EXTS):
-                files.append(os.path.join(root,f))
-    files.sort()
-    return files
-
-def ensure_thumbnail(show):
-    # returns path accessible by poster endpoint: prefer poster.jpg/png, else generate thumb.png into STATIC_DIR/<show>.png
+    # cached; callers must not mutate the returned list
+    return LIBRARY.videos(show)
+
+def find_poster(show):
+    # poster.jpg/png or cover.jpg/png in the show folder, else an already generated
+    # STATIC_DIR/<show>.png, else None
     sdir = os.path.join(ANIME_DIR, show)
     for name in ("poster.jpg","poster.png","cover.jpg","cover.png"):
         p = os.path.join(sdir, name)
         if os.path.exists(p): return p
-    # generate if not exists
     target = os.path.join(STATIC_DIR, f"{show}.png")
     if os.path.exists(target): return target
+    return None
+
+def generate_thumbnail(show):
+    # extract a frame from the first episode into STATIC_DIR/<show>.png; returns the path or None
+    p = find_poster(show)
+    if p: return p
     vids = build_video_list(show)
     if not vids:
-        return os.path.join(STATIC_DIR,"fallback.png")
+        return None
     first = vids[0]
+    target = os.path.join(STATIC_DIR, f"{show}.png")
+    # write to a temp name and rename, so a half written file is never served
+    tmp = os.path.join(STATIC_DIR, f"{show}.{threading.get_ident()}.tmp.png")
     # run ffmpeg to extract frame at 00:00:05 (if available)
     try:
-        os.makedirs(STATIC_DIR, exist_ok=True)
-        cmd = ["ffmpeg","-y","-i", first, "-ss","00:00:05","-vframes","1","-vf","scale=400:-1", target]
-        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False, timeout=20)
-        if os.path.exists(target): return target
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        cmd = ["ffmpeg","-y","-i", first, "-ss","00:00:05","-vframes","1","-vf","scale=400:-1", tmp]
+        with M_THUMB_SECONDS.time("ffmpeg"):
+            subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False, timeout=20)
+        if os.path.exists(tmp):
+            os.replace(tmp, target)
+            return target
     except Exception:
         pass
-    return os.path.join(STATIC_DIR,"fallback.png")
+    try:
+        os.remove(tmp)
+    except OSError:
+        pass
+    return None
 
-# ---------------- Light sensor ----------------
-def read_lux():
+class PosterCache:
+    # resized copies of show posters in STATIC_DIR/posters, named by a hash of the source
+    # file's path, size and mtime (plus the output settings). the hash is also the ETag and
+    # the ?v= version in poster URLs, so a changed poster gets a new URL
+    def __init__(self, root, recheck=LIBRARY_RECHECK):
+        self.dir = os.path.join(root, "posters")
+        self.recheck = recheck
+        self.lock = threading.Lock()
+        self._entries = {}      # show -> (checked at, (key, path) or None)
+
+    def _variant(self, src):
+        st = os.stat(src)
+        key = hashlib.sha1(f"{src}|{st.st_size}|{st.st_mtime_ns}|{POSTER_SIZE}|{POSTER_FORMAT}".encode()).hexdigest()[:16]
+        return key, os.path.join(self.dir, f"{key}.{'jpg' if POSTER_FORMAT == 'jpeg' else POSTER_FORMAT}")
+
+    def lookup(self, show):
+        # (key, path) of the ready variant, or None. only touches the disk every recheck sec
+        now = time.monotonic()
+        with self.lock:
+            e = self._entries.get(show)
+        if e and now - e[0] < self.recheck:
+            return e[1]
+        res = None
+        src = find_poster(show)
+        if src:
+            try:
+                key, path = self._variant(src)
+                if os.path.exists(path): res = (key, path)
+            except OSError:
+                pass
+        with self.lock:
+            self._entries[show] = (now, res)
+        return res
+
+    def build(self, show):
+        # create the variant for the show's current poster; returns (key, path) or None
+        src = find_poster(show)
+        if not src: return None
+        key, path = self._variant(src)
+        if not os.path.exists(path):
+            try:
+                from PIL import Image, ImageOps
+            except ImportError:
+                # no Pillow: serve the original file, still versioned by its hash
+                path = src
+            else:
+                os.makedirs(self.dir, exist_ok=True)
+                tmp = f"{path}.{threading.get_ident()}.tmp"
+                try:
+                    with M_THUMB_SECONDS.time("resize"), Image.open(src) as img:
+                        img = ImageOps.exif_transpose(img)
+                        img.thumbnail(POSTER_SIZE)
+                        if POSTER_FORMAT == "jpeg" or img.mode not in ("RGB","RGBA"): img = img.convert("RGB")
+                        img.save(tmp, format=POSTER_FORMAT, quality=80)
+                    os.replace(tmp, path)
+                except Exception:
+                    # Pillow can't read the poster or write the format: serve the original too
+                    path = src
+                finally:
+                    try:
+                        os.remove(tmp)
+                    except OSError:
+                        pass
+        with self.lock:
+            old = self._entries.get(show)
+            self._entries[show] = (time.monotonic(), (key, path))
+        if not (old and old[1] and old[1][0] == key): STATE.touch(shows=[show])
+        # drop the variant of a poster that was replaced
+        if old and old[1] and old[1][0] != key and old[1][1].startswith(self.dir):
+            try:
+                os.remove(old[1][1])
+            except OSError:
+                pass
+        return key, path
+
+POSTERS = PosterCache(STATIC_DIR)
+
+def poster_url(show):
+    # stable, versioned URL once the poster variant exists; otherwise the bare URL (fallback)
+    v = POSTERS.lookup(show)
+    return f"/poster/{quote(show, safe='')}?v={v[0]}" if v else f"/poster/{quote(show, safe='')}"
+
+PRIO_VISIBLE, PRIO_NEXT_UP, PRIO_BACKGROUND = 0, 1, 10
+
+class ThumbnailService:
+    # bounded pool of thumbnail workers fed from a priority queue. requests for a show that is
+    # already queued or running merge into that job (re-queued only if the priority improved)
+    def __init__(self, workers=THUMB_WORKERS):
+        self.workers = workers
+        self.q = queue.PriorityQueue()
+        self.lock = threading.Lock()
+        self.pending = {}   # show -> best queued priority
+        self.failed = {}    # show -> monotonic time of the last failed attempt
+        self.counter = itertools.count()
+        self.started = False
+
+    def _start(self):
+        self.started = True
+        for _ in range(self.workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def request(self, show, priority=PRIO_BACKGROUND):
+        with self.lock:
+            if not self.started: self._start()
+            p = self.pending.get(show)
+            if p is not None and p <= priority: return
+            if time.monotonic() - self.failed.get(show, -THUMB_RETRY) < THUMB_RETRY: return
+            self.pending[show] = priority
+            self.q.put((priority, next(self.counter), show))
+
+    def pregenerate(self, names):
+        # queue every show without a poster; the head of each frame's playlist goes first
+        head = {n for f in FRAMES for n in f.queue.names()[:THUMB_NEXT_UP]}
+        for show in names:
+            if POSTERS.lookup(show) is None:
+                self.request(show, PRIO_NEXT_UP if show in head else PRIO_BACKGROUND)
+
+    def _worker(self):
+        while True:
+            prio, _, show = self.q.get()
+            with self.lock:
+                # stale entry: superseded by a higher priority one, or already done
+                if self.pending.get(show) != prio: continue
+            ok = False
+            try:
+                ok = generate_thumbnail(show) is not None and POSTERS.build(show) is not None
+            except Exception:
+                pass
+            finally:
+                M_THUMBS.inc("ok" if ok else "failed")
+                with self.lock:
+                    if not ok: self.failed[show] = time.monotonic()
+                    else: self.failed.pop(show, None)
+                    if self.pending.get(show) == prio: del self.pending[show]
+
+THUMBS = ThumbnailService()
+
+def probe_media(path):
+    # (duration in ms or None, [stream info]) from ffprobe. raises OSError if ffprobe is missing
+    # and subprocess.TimeoutExpired if it hangs
+    cmd = ["ffprobe","-v","error","-print_format","json","-show_entries",
+           "format=duration:stream=codec_type,codec_name,width,height,channels:stream_tags=language", path]
+    with M_PROBE_SECONDS.time():
+        r = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False, timeout=PROBE_TIMEOUT)
     try:
-        with SMBus(I2C_BUS) as bus:
-            data = bus.read_i2c_block_data(BH1750_ADDR, 0x10)
-            lux = (data[0]<<8 | data[1]) / 1.2
-            return lux
-    except Exception:
-        return None
+        info = json.loads(r.stdout or b"{}")
+    except ValueError:
+        info = {}
+    try:
+        duration = int(float(info["format"]["duration"]) * 1000)
+    except (KeyError, TypeError, ValueError):
+        duration = None
+    streams = []
+    for st in info.get("streams") or []:
+        st = {"type": st.get("codec_type"), "codec": st.get("codec_name"), "width": st.get("width"), "height": st.get("height"),
+              "channels": st.get("channels"), "language": (st.get("tags") or {}).get("language")}
+        streams.append({k: v for k,v in st.items() if v is not None})
+    return duration, streams
+
+class ProbeService:
+    # duration and stream info of every episode from a bounded pool of ffprobe workers, fed from
+    # a priority queue like the thumbnails. results are kept in the probes table (and memory)
+    # under the file's path, size and mtime, so a file is probed again only once it changed; one
+    # ffprobe can't read is stored without a duration and not retried until then
+    RUNNING = -1
+    def __init__(self, root, workers=PROBE_WORKERS, batch=PROBE_BATCH):
+        self.root = root
+        self.workers = workers
+        self.batch = batch
+        self.q = queue.PriorityQueue()
+        self.lock = threading.Lock()
+        self.pending = {}       # path -> best queued priority (RUNNING while being probed)
+        self.counter = itertools.count()
+        self.started = False
+        self.available = True   # False once ffprobe turned out to be missing
+        self._probes = None     # path -> (size, mtime, duration_ms, streams json)
+        self._results = []      # probed but not written yet: (relpath, size, mtime, duration_ms, streams json, show)
+        self._durations = {}    # show -> (video list they were looked up for, [duration_ms or None])
+
+    def _ensure(self):
+        # call with self.lock held
+        if self._probes is None:
+            rows = db_read("SELECT path,size,mtime,duration_ms,streams FROM probes")
+            self._probes = {os.path.join(self.root, p): (sz, m, d, st) for p,sz,m,d,st in rows}
+
+    def _lookup(self, path, size, mtime):
+        # call with self.lock held; the cached probe if it is for this version of the file
+        p = self._probes.get(path)
+        return p if p and size is not None and (p[0], p[1]) == (size, mtime) else None
+
+    def request(self, show, priority=PRIO_BACKGROUND):
+        # queue the show's episodes that have no probe for their current size and mtime
+        files = LIBRARY.files(show)
+        with self.lock:
+            if not self.available: return
+            self._ensure()
+            if not self.started:
+                self.started = True
+                for _ in range(self.workers):
+                    threading.Thread(target=self._worker, daemon=True).start()
+            for path,size,mtime in files:
+                if self._lookup(path, size, mtime): continue
+                p = self.pending.get(path)
+                if p is not None and p <= priority: continue
+                self.pending[path] = priority
+                self.q.put((priority, next(self.counter), path, show))
+
+    def pregenerate(self, names):
+        # queue every show; the head of each frame's playlist goes first
+        head = {n for f in FRAMES for n in f.queue.names()[:THUMB_NEXT_UP]}
+        for show in names:
+            self.request(show, PRIO_NEXT_UP if show in head else PRIO_BACKGROUND)
+
+    def durations(self, show):
+        # [duration_ms or None (not probed yet, or unreadable)] per episode of the show
+        videos = build_video_list(show)
+        with self.lock:
+            d = self._durations.get(show)
+            if d and d[0] is videos: return d[1]
+        files = LIBRARY.files(show)
+        with self.lock:
+            self._ensure()
+            out = [(self._lookup(*f) or (0, 0, None))[2] for f in files]
+            self._durations[show] = (videos, out)
+        return out
+
+    def episodes(self, show):
+        # [{"file", "duration_ms", "streams"}] per episode, as far as probed
+        files = LIBRARY.files(show)
+        with self.lock:
+            self._ensure()
+            hits = [self._lookup(*f) for f in files]
+        return [{"file": os.path.basename(f[0]), "duration_ms": h[2] if h else None,
+                 "streams": json.loads(h[3] or "[]") if h else None, "probed": h is not None} for f,h in zip(files, hits)]
+
+    def stats(self):
+        with self.lock:
+            return {"available": self.available, "pending": len(self.pending), "cached": len(self._probes or ())}
+
+    def _worker(self):
+        while True:
+            prio, _, path, show = self.q.get()
+            with self.lock:
+                if self.pending.get(path) != prio: continue
+                # a request now (even at a better priority) doesn't queue it again
+                self.pending[path] = self.RUNNING
+            result = None
+            try:
+                # the size/mtime at probe time, so a file changed while queued isn't cached as stale
+                st = os.stat(path)
+                duration, streams = probe_media(path)
+                result = (st.st_size, st.st_mtime_ns, duration, json.dumps(streams))
+                M_PROBES.inc("ok" if duration is not None else "unreadable")
+            except FileNotFoundError:
+                if os.path.exists(path):
+                    # no ffprobe: stop probing (durations stay unknown)
+                    with self.lock:
+                        self.available = False
+                        self.pending.clear()
+                M_PROBES.inc("failed")
+            except Exception:
+                # timeout or a vanished file: not cached, so the next request tries again
+                M_PROBES.inc("failed")
+            with self.lock:
+                self.pending.pop(path, None)
+                if result:
+                    self._probes[path] = result
+                    self._durations.pop(show, None)
+                    self._results.append((os.path.relpath(path, self.root),) + result + (show,))
+                flush = len(self._results) >= self.batch or (self._results and not self.pending)
+            if flush: self.flush()
+
+    def flush(self):
+        # write probed results in one transaction and push the shows' new durations to the UI
+        with self.lock:
+            batch, self._results = self._results, []
+        if not batch: return
+        with db_transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO probes(path,size,mtime,duration_ms,streams) VALUES(?,?,?,?,?)",
+                             [r[:5] for r in batch])
+        STATE.touch(shows=sorted({r[5] for r in batch}))
+
+PROBES = ProbeService(ANIME_DIR)
+# probe new and changed episodes whenever a show's folders were listed again
+LIBRARY.listeners.append(PROBES.request)
+
+# ---------------- Light sensor ----------------
+class LuxSampler:
+    # one thread keeps the I2C bus open and reads the BH1750 every `interval` sec into a ring
+    # buffer. lux() is the median of the last `window` good samples, and bright() only flips
+    # once that leaves the threshold +/- hysteresis band, so a passing shadow or a flickering
+    # lamp doesn't pause playback. bus_factory makes it usable with a fake SMBus
+    def __init__(self, bus_factory=lambda: SMBus(I2C_BUS), addr=BH1750_ADDR, interval=LUX_SAMPLE_INTERVAL,
+                 window=LUX_SMOOTHING, history=LUX_HISTORY, threshold=LIGHT_THRESHOLD, hysteresis=LIGHT_HYSTERESIS):
+        self.bus_factory = bus_factory
+        self.addr = addr
+        self.interval = interval
+        self.window = window
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.lock = threading.Lock()
+        self.samples = collections.deque(maxlen=history)    # (unix time, lux or None)
+        self._lux = None
+        self._bright = None
+        self._reported = None   # lux last pushed to the UI
+        self._bus = None
+        self.started = False
+        self.listeners = []     # callables(bright), run when the decision flips
+
+    def start(self):
+        # frames sharing the sensor all start it; one thread reads it
+        with self.lock:
+            if self.started: return
+            self.started = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _read(self):
+        t = time.perf_counter()
+        try:
+            if self._bus is None: self._bus = self.bus_factory()
+            data = self._bus.read_i2c_block_data(self.addr, 0x10, 2)   # continuous high-res mode, 2-byte result
+            M_LUX_SECONDS.observe(time.perf_counter() - t)
+            M_LUX_READS.inc("ok")
+            return (data[0]<<8 | data[1]) / 1.2
+        except Exception:
+            M_LUX_READS.inc("error")
+            # reopen the bus on the next read
+            try:
+                if self._bus is not None: self._bus.close()
+            except Exception:
+                pass
+            self._bus = None
+            return None
+
+    def sample(self):
+        # take one reading and update the smoothed value and decision
+        lux = self._read()
+        with self.lock:
+            self.samples.append((time.time(), lux))
+            recent = sorted(v for _,v in itertools.islice(reversed(self.samples), self.window) if v is not None)
+            old_bright = self._bright
+            self._lux = recent[len(recent)//2] if recent else None
+            if self._lux is None:
+                self._bright = None
+            elif self._bright is None:
+                self._bright = self._lux > self.threshold
+            elif self._bright and self._lux < self.threshold - self.hysteresis:
+                self._bright = False
+            elif not self._bright and self._lux > self.threshold + self.hysteresis:
+                self._bright = True
+            bright = self._bright
+            # every open UI gets a status delta for this: only for a flip or a sizeable change
+            report = bool(bright) != bool(old_bright) or (self._reported is None) != (self._lux is None) or (
+                self._lux is not None and abs(self._lux - self._reported) >= max(1, self._reported*LUX_REPORT_CHANGE))
+            if report: self._reported = self._lux
+        if report:
+            STATE.touch(status=True)
+        if bool(bright) != bool(old_bright):
+            for fn in self.listeners:
+                fn(bright)
+        return lux
+
+    def _run(self):
+        next_t = time.monotonic()
+        while running:
+            self.sample()
+            next_t += self.interval
+            time.sleep(max(0, next_t - time.monotonic()))
+
+    def lux(self):
+        return self._lux
+
+    def bright(self):
+        # True/False, or None while there is no reading
+        return self._bright
+
+    def history(self, seconds=None):
+        with self.lock:
+            samples = list(self.samples)
+        if seconds is not None:
+            cutoff = time.time() - seconds
+            samples = [s for s in samples if s[0] >= cutoff]
+        return samples
+
+SENSORS = {}    # (i2c bus, address) -> LuxSampler; frames naming the same sensor share it
+
+def lux_sensor(bus=I2C_BUS, addr=BH1750_ADDR):
+    if (bus, addr) not in SENSORS:
+        SENSORS[bus, addr] = LuxSampler(bus_factory=lambda: SMBus(bus), addr=addr)
+    return SENSORS[bus, addr]
+
+def read_lux(frame=None):
+    # latest smoothed value from the sampler thread (None if no reading)
+    return (frame or FRAMES[0]).lux.lux()
+
+# ---------------- Schedule ----------------
+DAYS = ("monday","tuesday","wednesday","thursday","friday","saturday","sunday")
+DAY_NAMES = {n: i for i,d in enumerate(DAYS) for n in (d, d[:3])}   # full name or 3-letter abbreviation
+WEEK = 7*86400
+
+def parse_schedule_windows(spec):
+    # "Mon-Fri 07:00-08:30 18:00-23:00; Sat,Sun 09:00-23:30" -> [(weekdays, start sec, end sec)].
+    # entries are separated by ";" or newlines; no days means every day. a window whose end is
+    # before its start crosses midnight and belongs to the day it starts on
+    windows = []
+    for entry in re.split(r"[;\n]", spec or ""):
+        days, ranges = set(), []
+        for tok in entry.replace(",", " ").split():
+            m = re.fullmatch(r"(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})", tok)
+            d = re.fullmatch(r"([a-z]+)(?:-([a-z]+))?", tok.lower())
+            if m:
+                sh, sm, eh, em = map(int, m.groups())
+                if sh > 23 or eh > 23 or sm > 59 or em > 59: raise ValueError(f"bad time in {tok!r}")
+                ranges.append((sh*3600 + sm*60, eh*3600 + em*60))
+            elif d and d.group(1) in DAY_NAMES and (d.group(2) is None or d.group(2) in DAY_NAMES):
+                a = DAY_NAMES[d.group(1)]
+                b = DAY_NAMES[d.group(2)] if d.group(2) else a
+                days.update((a + i) % 7 for i in range((b - a) % 7 + 1))
+            else:
+                raise ValueError(f"can't parse {tok!r}")
+        if days and not ranges: raise ValueError(f"no time range in {entry.strip()!r}")
+        windows += [(frozenset(days or range(7)), start, end) for start,end in ranges]
+    return windows
+
+class Schedule:
+    # play windows compiled into sorted, merged [start, end) intervals over the week (seconds
+    # since Monday 00:00), so allowed() and the next allow/deny transition are a bisect away
+    def __init__(self, windows):
+        spans = []
+        for days, start, end in windows:
+            length = (end - start) % 86400
+            for day in days:
+                a = day*86400 + start
+                # split windows that wrap past Sunday midnight
+                if a + length <= WEEK: spans.append((a, a + length))
+                else: spans += [(a, WEEK), (0, a + length - WEEK)]
+        merged = []
+        for a,b in sorted(x for x in spans if x[1] > x[0]):
+            if merged and a <= merged[-1][1]: merged[-1][1] = max(merged[-1][1], b)
+            else: merged.append([a, b])
+        self.starts = [a for a,_ in merged]
+        self.ends = [b for _,b in merged]
+
+    @staticmethod
+    def _week_secs(now):
+        return now.weekday()*86400 + now.hour*3600 + now.minute*60 + now.second + now.microsecond/1e6
+
+    def allowed(self, now=None):
+        t = self._week_secs(now or datetime.now())
+        i = bisect.bisect_right(self.starts, t) - 1
+        return i >= 0 and t < self.ends[i]
+
+    def next_transition(self, now=None):
+        # seconds until playback switches between allowed and denied; None if it never does
+        if not self.starts or (self.starts[0] == 0 and self.ends[0] == WEEK): return None
+        t = self._week_secs(now or datetime.now())
+        i = bisect.bisect_right(self.starts, t) - 1
+        if i >= 0 and t < self.ends[i]:
+            end = self.ends[i]
+            # an interval ending at Sunday midnight continues if another starts at Monday 00:00
+            if end == WEEK and self.starts[0] == 0: return end - t + self.ends[0]
+            return end - t
+        nxt = bisect.bisect_right(self.starts, t)
+        return (self.starts[nxt] - t) if nxt < len(self.starts) else (WEEK - t + self.starts[0])
+
+class Scheduler:
+    # one frame's schedule settings compiled once per change; schedule_windows (if set) replaces
+    # the single daily schedule_start/schedule_end window
+    def __init__(self, frame):
+        self.frame = frame
+        self._key = None
+        self._schedule = None
+
+    def schedule(self):
+        get = self.frame.setting
+        key = (get("schedule_start") or "08:00", get("schedule_end") or "23:00", get("schedule_windows") or "")
+        if key != self._key:
+            start, end, spec = key
+            try:
+                windows = parse_schedule_windows(spec) if spec.strip() else parse_schedule_windows(f"{start}-{end}")
+            except ValueError:
+                windows = []
+            self._key, self._schedule = key, Schedule(windows)
+        return self._schedule
+
+    def enabled(self):
+        return self.frame.setting("schedule_enabled") == "1"
+
+    def allowed(self, now=None):
+        return not self.enabled() or self.schedule().allowed(now)
+
+    def next_transition(self, now=None):
+        # seconds until the schedule next changes its mind (None if disabled or never)
+        return self.schedule().next_transition(now) if self.enabled() else None
+
+def schedule_wait(timeout, scheduler):
+    # timeout, shortened so the thread wakes right at the next schedule transition
+    t = scheduler.next_transition()
+    return timeout if t is None else max(0.05, min(timeout, t + 0.05))
+
+# ---------------- Frames ----------------
+class Frame:
+    # one picture frame: a Kodi with its own play order, progress, schedule, light sensor and
+    # playback thread. settings are per frame: the first frame uses the plain keys, the others
+    # "<name>/<key>", falling back to the plain (first frame's) value while unset
+    def __init__(self, name, prefix="", kodi_url=KODI_URL, kodi_auth=KODI_AUTH, events_host=None,
+                 events_port=KODI_EVENTS_PORT, i2c_bus=I2C_BUS, bh1750_addr=BH1750_ADDR):
+        if events_host is None:
+            # notifications come from the same Kodi as the JSON-RPC calls
+            events_host = KODI_EVENTS_HOST if kodi_url == KODI_URL else urlparse(kodi_url).hostname
+        self.name = name
+        self.prefix = prefix
+        self.kodi = KodiClient(kodi_url, tuple(kodi_auth) if kodi_auth else None, name=name)
+        self.events = self.kodi.events = KodiEvents(events_host, events_port, self.kodi)
+        self.queue = PlayQueue(name)
+        self.progress = ProgressJournal(name)
+        self.scheduler = Scheduler(self)
+        self.lux = lux_sensor(i2c_bus, bh1750_addr)
+        self.now_playing = {"show": None, "episode_index": None}
+        # set to wake the playback thread early: a settings change, a Kodi notification, health
+        # change or dropped notification socket, or a light sensor flip
+        self.wake_event = threading.Event()
+        self.thread = None
+        self.events.listeners.append(self.wake)
+        # a dropped socket means polling Kodi again instead of waiting for notifications
+        self.events.connection_listeners.append(self.wake)
+        self.kodi.listeners.append(self.wake)
+        self.kodi.listeners.append(lambda up: STATE.touch(status=True))
+        self.lux.listeners.append(self.wake)
+
+    def setting(self, key):
+        v = SETTINGS.get(self.prefix + key) if self.prefix else None
+        return SETTINGS.get(key) if v is None else v
+
+    def update_settings(self, values):
+        return SETTINGS.update({self.prefix + k: v for k,v in values.items()})
+
+    def set_now_playing(self, show, ep_idx=None):
+        if (self.now_playing["show"], self.now_playing["episode_index"]) == (show, ep_idx): return
+        old = self.now_playing["show"]
+        self.now_playing.update(show=show, episode_index=ep_idx)
+        # both shows too, so views filtered on "playing" get them in their deltas
+        STATE.touch(shows=[n for n in {old, show} if n], status=True)
+
+    def wake(self, *_):
+        self.wake_event.set()
+
+    def wait(self, timeout):
+        self.wake_event.wait(timeout)
+        self.wake_event.clear()
+
+    def start(self):
+        # sensor, notifications and the playback thread; each frame's Kodi calls run on its own
+        # threads, so a slow or offline Kodi doesn't hold up the others
+        self.lux.start()
+        if self.events.port: self.events.start()
+        self.thread = threading.Thread(target=playback_thread, args=(self,), daemon=True, name=f"playback-{self.name}")
+        self.thread.start()
+
+def make_frames(config):
+    names = [c["name"] for c in config]
+    if not names or len(set(names)) != len(names) or any("/" in n for n in names):
+        raise ValueError(f"frame names must be unique and not contain '/': {names}")
+    return [Frame(prefix="" if i == 0 else c["name"] + "/", **c) for i,c in enumerate(config)]
+
+FRAMES = make_frames(FRAMES_CONFIG)
+FRAMES_BY_NAME = {f.name: f for f in FRAMES}
+
+def _wake_frames(keys):
+    # a settings change can start or stop playback (a frame's own keys or the shared defaults)
+    if any(k.rpartition("/")[2] in SETTING_KEYS for k in keys):
+        for f in FRAMES: f.wake()
+
+SETTINGS.listeners.append(_wake_frames)
+FRAME_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=len(FRAMES), thread_name_prefix="frame")
+
+def each_frame(fn, frames=None):
+    # fn(frame) for several frames at once (Kodi round trips overlap); results in frame order
+    return list(FRAME_POOL.map(fn, FRAMES if frames is None else frames))
 
 # ---------------- Playback loop ----------------
 running = True
 
-def time_in_range(start_s, end_s, now=None):
-    if not now: now = datetime.now().time()
-    if start_s <= end_s:
-        return start_s <= now <= end_s
+def next_up(frame, name, ep_idx):
+    # (show, ep_idx, path, position_ms) that plays after ep_idx of name: its next episode, or
+    # once the show is finished, the next show in the rotation that has episodes: the finished
+    # show moves to the back, so that is the first other show in play order (the same one the
+    # cold path would take from the head of the queue). None if empty
+    videos = build_video_list(name)
+    if ep_idx + 1 < len(videos): return name, ep_idx + 1, videos[ep_idx + 1], 0
+    order = frame.queue.names()
+    for other in [n for n in order if n != name] + [name]:
+        vids = build_video_list(other)
+        rows = db_read("SELECT episode_index,position_ms FROM shows WHERE frame=? AND name=?", (frame.name, other))
+        if not vids or not rows: continue
+        if other == name: return name, 0, vids[0], 0
+        e, ms = rows[0]
+        if e >= len(vids): e, ms = 0, 0
+        return other, e, vids[e], ms or 0
+    return None
+
+def advance_show(frame, name, ep_idx):
+    # ep_idx of name played to the end: move on to the next episode, or reset the series and
+    # rotate the show to the end (so round-robin moves to the next show)
+    frame.progress.discard(name)
+    videos = build_video_list(name)
+    if ep_idx + 1 < len(videos):
+        with db_transaction() as conn:
+            conn.execute("UPDATE shows SET episode_index=?, position_ms=0 WHERE frame=? AND name=?", (ep_idx+1, frame.name, name))
+        STATE.touch(shows=[name])
     else:
-        # crosses midnight
-        return now >= start_s or now <= end_s
+        frame.queue.rotate(name, also=[("UPDATE shows SET episode_index=0, position_ms=0 WHERE frame=? AND name=?", (frame.name, name))])
 
-def playback_thread():
-    # main loop: check DB shows in order, play when allowed
+def playback_thread(frame):
+    # one frame's main loop: check its shows in order, play when allowed
     while running:
-        # read settings
-        use_light = db_get_setting("use_light") == "1"
-        schedule_enabled = db_get_setting("schedule_enabled") == "1"
-        sched_start = db_get_setting("schedule_start") or "08:00"
-        sched_end = db_get_setting("schedule_end") or "23:00"
+        # read settings (in memory)
+        use_light = frame.setting("use_light") == "1"
+        schedule_enabled = frame.scheduler.enabled()
         # determine permission to play
         allow_light = True
         if use_light:
-            lux = read_lux()
-            allow_light = (lux is not None and lux > LIGHT_THRESHOLD)
-        else:
-            lux = None
-        allow_sched = True
-        if schedule_enabled:
-            s_h, s_m = map(int, sched_start.split(":"))
-            e_h, e_m = map(int, sched_end.split(":"))
-            allow_sched = time_in_range(dt_time(s_h,s_m), dt_time(e_h,e_m))
+            allow_light = bool(frame.lux.bright())
+        allow_sched = frame.scheduler.allowed()
         # snapshot shows
-        shows = db_all_shows()
+        shows = db_all_shows(frame)
         if not shows:
             # populate DB from disk if empty
-            for s in list_shows_on_disk():
-                db_add_show(s)
+            frame.queue.add(list_shows_on_disk())
             time.sleep(SENSOR_POLL)
             continue
         # if both allowed (or respective disabled), play; implement: play only if (allow_light or not use_light) and (allow_sched or not schedule_enabled)
+        if not frame.kodi.up:
+            # Kodi is offline: wait for the health probe to see it again, then resume the head
+            # show from its saved position
+            frame.wait(schedule_wait(SCHEDULE_MAX_SLEEP, frame.scheduler))
+            continue
         if (allow_light or not use_light) and (allow_sched or not schedule_enabled):
-            # get the first show by order that we should play (we pick the show with lowest order idx)
-            with DB_LOCK:
-                cur = DB.cursor()
-                cur.execute("SELECT name,episode_index,timestamp FROM shows ORDER BY order_idx LIMIT 1")
-                row = cur.fetchone()
-            if not row:
+            # get the first show by order that we should play (head of the queue)
+            name = frame.queue.head()
+            rows = db_read("SELECT episode_index,position_ms FROM shows WHERE frame=? AND name=?", (frame.name, name)) if name else []
+            if not rows:
                 time.sleep(SENSOR_POLL); continue
-            name, ep_idx, timestamp = row
+            ep_idx, position_ms = rows[0]
             videos = build_video_list(name)
             if not videos:
                 # nothing on disk for this show -> remove or skip. we skip and rotate
-                with DB_LOCK:
-                    DB.execute("UPDATE shows SET order_idx = (SELECT COALESCE(MAX(order_idx),0)+1 FROM shows) WHERE name=?", (name,))
-                    DB.commit()
+                frame.queue.rotate(name)
                 time.sleep(1); continue
             # ensure index valid
             if ep_idx >= len(videos): ep_idx = 0
             file_to_play = videos[ep_idx]
-            # start playback at timestamp
-            kodi_open_and_seek(file_to_play, timestamp or "00:00:00")
-            # while still allowed, update timestamp
+            frame.set_now_playing(name, ep_idx)
+            # start playback at the saved position, with whatever plays next already queued in Kodi
+            nxt = next_up(frame, name, ep_idx)
+            frame.kodi.play_queue(file_to_play, position_ms or 0, nxt and nxt[2])
+            since = frame.events.seq
+            # while still allowed, update timestamp. stops, pauses and playlist transitions
+            # arrive as notifications; Kodi itself is only polled every KODI_HEARTBEAT sec while
+            # those are connected, just after the episode is due to end, and when the progress
+            # journal is due to flush (so it writes a fresh position)
+            ended = False
+            last_st, last_poll, paused = None, 0, False
             while True:
-                time.sleep(SENSOR_POLL)
-                if use_light:
-                    lux_now = read_lux()
-                    if not (lux_now is not None and lux_now > LIGHT_THRESHOLD):
-                        # save and pause
-                        cur_time = kodi_get_time()
-                        db_update_progress(name, ep_idx, cur_time)
-                        kodi_pause()
-                        break
-                if schedule_enabled:
-                    s_h, s_m = map(int, sched_start.split(":"))
-                    e_h, e_m = map(int, sched_end.split(":"))
-                    if not time_in_range(dt_time(s_h,s_m), dt_time(e_h,e_m)):
-                        cur_time = kodi_get_time()
-                        db_update_progress(name, ep_idx, cur_time)
-                        kodi_pause()
-                        break
-                # update timestamp periodically
-                cur_time = kodi_get_time()
-                db_update_progress(name, ep_idx, cur_time)
-            # after pause, advance episode or restart series and rotate order
-            videos = build_video_list(name)
-            if ep_idx + 1 < len(videos):
-                with DB_LOCK:
-                    DB.execute("UPDATE shows SET episode_index=? WHERE name=?", (ep_idx+1, name))
-                    DB.commit()
-            else:
-                # finished -> reset episode_index to 0 AND rotate show to end (so round-robin moves to next show)
-                with DB_LOCK:
-                    # set episode to 0 and bump order_idx to max+1 (rotate)
-                    DB.execute("UPDATE shows SET episode_index=0 WHERE name=?", (name,))
-                    DB.execute("UPDATE shows SET order_idx = (SELECT COALESCE(MAX(order_idx),0)+1 FROM shows)")
-                    DB.commit()
+                timeout = min(KODI_HEARTBEAT if frame.events.connected else SENSOR_POLL, max(0.5, frame.progress.due_in()))
+                if last_st is not None:
+                    left = _kodi_secs(last_st.get("totaltime")) - _kodi_secs(last_st.get("time")) - (time.monotonic() - last_poll)
+                    timeout = min(timeout, max(0.5, left + 0.5))
+                frame.wait(schedule_wait(timeout, frame.scheduler))
+                stopped = started = False
+                while True:
+                    ev = frame.events.wait_for(("Player.OnStop","Player.OnPause","Player.OnAVStart"), since, 0)
+                    if not ev: break
+                    since = ev[0]
+                    if ev[1] == "Player.OnStop":
+                        # end=True: the episode played to the end
+                        stopped, ended = True, bool(ev[2].get("end"))
+                    elif ev[1] == "Player.OnPause":
+                        # paused on the remote: save now
+                        last_poll, paused = 0, True
+                    else:
+                        # a stream started: Kodi moved on to the queued item (which hasn't ended)
+                        stopped, started, ended = False, True, False
+                if stopped and ended and nxt:
+                    # Kodi reports the end of each playlist item; see if it moves on to the next
+                    ev = frame.events.wait_for(("Player.OnAVStart",), since, KODI_START_TIMEOUT)
+                    if ev: since, stopped, started, ended = ev[0], False, True, False
+                if stopped or not frame.kodi.up: break
+                # a schedule or light sensor change from the UI applies right away
+                use_light = frame.setting("use_light") == "1"
+                if (use_light and not frame.lux.bright()) or not frame.scheduler.allowed():
+                    # save and pause (keeping the last recorded position if Kodi doesn't answer)
+                    st = frame.kodi.status()
+                    if st: db_update_progress(frame, name, ep_idx, _kodi_ms(st.get("time")))
+                    else: frame.progress.flush()
+                    frame.kodi.pause()
+                    break
+                # a reorder may have changed what should play next
+                want = next_up(frame, name, ep_idx)
+                if (want and want[2]) != (nxt and nxt[2]):
+                    nxt = want
+                    frame.kodi.queue_next(nxt and nxt[2], 1)
+                # update timestamp periodically (and right away after a stream started)
+                now = time.monotonic()
+                due = last_st is not None and now - last_poll >= _kodi_secs(last_st.get("totaltime")) - _kodi_secs(last_st.get("time"))
+                if frame.events.connected and not (started or due or frame.progress.due_in() <= 0) and now - last_poll < KODI_HEARTBEAT: continue
+                st = frame.kodi.status(properties=("time","totaltime","position"))
+                if st is None and frame.kodi.errors and frame.kodi.up:
+                    # the request failed but the breaker is still closed: poll again next round
+                    # rather than restarting the episode from the last recorded position
+                    continue
+                if st is None:
+                    # player went away without a notification: count it as the end of the
+                    # episode if the last poll was close enough to the end (not if Kodi itself
+                    # went away; then it resumes from the last recorded position)
+                    ended = frame.kodi.up and last_st is not None and _kodi_secs(last_st.get("totaltime")) - _kodi_secs(last_st.get("time")) <= now - last_poll + 2
+                    break
+                if nxt and st.get("position") == 1:
+                    # Kodi moved on to the queued episode: record the one that finished, then
+                    # carry on with the new one and queue the one after it
+                    advance_show(frame, name, ep_idx)
+                    ended = False
+                    name, ep_idx, file_to_play, position_ms = nxt
+                    frame.set_now_playing(name, ep_idx)
+                    frame.kodi.seek(st["playerid"], position_ms)
+                    nxt = next_up(frame, name, ep_idx)
+                    frame.kodi.queue_next(nxt and nxt[2], 0)
+                    last_st, last_poll = None, now
+                    continue
+                last_st, last_poll = st, now
+                frame.progress.record(name, ep_idx, _kodi_ms(st.get("time")))
+                if paused:
+                    frame.progress.flush()
+                    paused = False
+            frame.set_now_playing(None)
+            if not ended:
+                frame.progress.flush()
+                # paused/stopped part way: resume this episode at the saved position next time
+                frame.wait(SENSOR_POLL)
+                continue
+            # episode finished (and nothing was queued behind it): advance and go round again
+            advance_show(frame, name, ep_idx)
             # small delay then continue loop
             time.sleep(0.5)
         else:
-            # not allowed to play: update lux snapshot in DB settings for UI and sleep
-            if lux is not None:
-                db_set_setting("last_lux", str(lux))
-            time.sleep(SENSOR_POLL)
+            # not allowed to play: sleep until the next schedule transition, a light sensor
+            # flip or a settings change
+            frame.wait(schedule_wait(SCHEDULE_MAX_SLEEP, frame.scheduler))
 
 # ---------------- Flask App ----------------
 app = Flask(__name__)
 
+@app.before_request
+def _request_start():
+    g.t_start = time.perf_counter()
+
+@app.after_request
+def _request_done(resp):
+    # labelled by route pattern (not the path) so per-show URLs share one series
+    if "t_start" in g:
+        rule = request.url_rule.rule if request.url_rule else "unmatched"
+        M_HTTP_SECONDS.observe(time.perf_counter() - g.t_start, rule, request.method, resp.status_code)
+    return resp
+
+@app.route("/metrics")
+def metrics():
+    return Response(metrics_text(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/")
 def ui():
     return render_template_string(UI_TEMPLATE)
 
 @app.route("/poster/<path:show>")
 def poster(show):
-    # prefer poster in folder; else generated thumbnail; else fallback
-    p = ensure_thumbnail(show)
-    if p.startswith(STATIC_DIR):
-        # serve from static dir
-        return send_from_directory(STATIC_DIR, os.path.basename(p))
+    # resized poster variant (from the folder poster or a generated thumbnail) with ETag and
+    # Last-Modified; the fallback is served right away while the variant is being made
+    v = POSTERS.lookup(show) if show in list_shows_on_disk() else None
+    if v is None:
+        if show in list_shows_on_disk(): THUMBS.request(show, PRIO_VISIBLE)
+        resp = send_from_directory(STATIC_DIR, "fallback.png")
+        resp.headers["Cache-Control"] = "no-store"
+        return resp
+    key, path = v
+    resp = send_file(path, conditional=True, etag=key, max_age=0)
+    if request.args.get("v") == key:
+        resp.headers["Cache-Control"] = f"public, max-age={POSTER_MAX_AGE}, immutable"
+    else:
+        # unversioned URL: cacheable, but revalidate (cheap 304) since the poster may change
+        resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+def show_entry(name, order_idx, ep_idx, position_ms):
+    # compute current playing episode name text and position; completion from the probed
+    # durations (None until the episode, or for the series every episode, has been probed)
+    vids = build_video_list(name)
+    cur_name = os.path.basename(vids[ep_idx]) if vids and ep_idx < len(vids) else None
+    pos = position_ms or 0
+    durs = PROBES.durations(name)
+    ep_ms = durs[ep_idx] if ep_idx < len(durs) else None
+    runtime = sum(durs) if durs and None not in durs else None
+    return {"name":name,"order":order_idx,"episode_index":ep_idx,"current_ep_name":cur_name,
+            "position":_fmt_ms(pos),"position_ms":pos,"duration_ms":ep_ms,"runtime_ms":runtime,
+            "episode_pct": round(100*min(pos, ep_ms)/ep_ms, 1) if ep_ms else None,
+            "series_pct": round(100*(sum(durs[:ep_idx]) + min(pos, ep_ms))/runtime, 1) if runtime and ep_ms is not None else None,
+            "poster":poster_url(name)}
+
+def request_frame():
+    # the frame named by ?frame= (default: the first one); 404 if there is no such frame
+    name = request.args.get("frame")
+    if not name: return FRAMES[0]
+    if name not in FRAMES_BY_NAME: abort(make_response(jsonify(success=False, msg=f"unknown frame {name!r}"), 404))
+    return FRAMES_BY_NAME[name]
+
+# ?filter= values for /api/state, over (name, order_idx, episode_index, position_ms) rows of a frame
+STATE_FILTERS = {
+    "started": lambda r, f: r[2] > 0 or bool(r[3]),
+    "unstarted": lambda r, f: r[2] == 0 and not r[3],
+    "playing": lambda r, f: r[0] == f.now_playing["show"],
+}
+
+def state_view(args):
+    # (q, filter, cursor, limit) from ?q= ?filter= ?cursor= ?limit=, or None if none are given
+    # (then the playlist is not paged). raises ValueError on an unknown filter
+    if not any(k in args for k in ("q","filter","cursor","limit")): return None
+    flt = args.get("filter") or None
+    if flt and flt not in STATE_FILTERS: raise ValueError(f"unknown filter {flt!r}")
+    limit = args.get("limit", type=int)
+    limit = STATE_PAGE_MAX if limit is None else max(0, min(limit, STATE_PAGE_MAX))
+    return (args.get("q") or "").casefold() or None, flt, args.get("cursor", type=int), limit
+
+def build_state(since=None, view=None, frame=None):
+    # one frame's full state, or (since = a version) only the shows, settings and status changed
+    # after it.
+    # with a view only matching shows are sent: a full state is one page of them (from the
+    # cursor, which is the order of the last show of the previous page) plus next_cursor, and
+    # a delta reports changed shows that stopped matching as removed. total = matching shows
+    frame = frame or FRAMES[0]
+    version, changed, removed, settings, status = STATE.changes(since)
+    # a delta of settings or status only (e.g. the light level) doesn't need the playlist
+    shows = changed is None or changed or removed
+    rows = db_all_shows(frame) if shows else []
+    # versions are shared by all frames: a show removed from another frame may still be here
+    if removed:
+        here = {r[0] for r in rows}
+        removed = [n for n in removed if n not in here]
+    out = {"version": STATE.token(version), "frame": frame.name, "full": changed is None, "removed": removed}
+    if view is None:
+        out["playlist"] = [show_entry(*r) for r in rows if changed is None or r[0] in changed]
     else:
-        # serve from show dir
-        showdir = os.path.join(ANIME_DIR, show)
-        return send_from_directory(showdir, os.path.basename(p))
+        q, flt, cursor, limit = view
+        hits = [r for r in rows if (q is None or q in r[0].casefold()) and (flt is None or STATE_FILTERS[flt](r, frame))]
+        if shows: out["total"] = len(hits)
+        if changed is None:
+            page = [r for r in hits if cursor is None or r[1] > cursor]
+            out["next_cursor"] = str(page[limit-1][1]) if 0 < limit < len(page) else None
+            page = page[:limit]
+        else:
+            page = [r for r in hits if r[0] in changed]
+            names = {r[0] for r in page}
+            out["removed"] = sorted(set(removed) | {n for n in changed if n not in names})
+        out["playlist"] = [show_entry(*r) for r in page]
+    if settings:
+        out.update({
+            "use_light": frame.setting("use_light") == "1",
+            "schedule_enabled": frame.setting("schedule_enabled") == "1",
+            "schedule_start": frame.setting("schedule_start"),
+            "schedule_end": frame.setting("schedule_end"),
+            "schedule_windows": frame.setting("schedule_windows") or ""})
+    if status:
+        lux = read_lux(frame)
+        out.update({"lux": round(lux, 1) if lux is not None else None, "now_playing": frame.now_playing["show"],
+                    "kodi": frame.kodi.health()})
+    return out
 
 @app.route("/api/state")
 def api_state():
-    shows = []
-    for name,order_idx,ep_idx,tstamp in db_all_shows():
-        # compute current playing episode name text and position
-        vids = build_video_list(name)
-        cur_name = os.path.basename(vids[ep_idx]) if vids and ep_idx < len(vids) else None
-        pos = tstamp or "00:00:00"
-        shows.append({"name":name,"order":order_idx,"episode_index":ep_idx,"current_ep_name":cur_name,"position":pos})
-    return jsonify({
-        "playlist": shows,
-        "use_light": db_get_setting("use_light") == "1",
-        "schedule_enabled": db_get_setting("schedule_enabled") == "1",
-        "schedule_start": db_get_setting("schedule_start"),
-        "schedule_end": db_get_setting("schedule_end"),
-        "lux": db_get_setting("last_lux")
-    })
+    # ?since=<version> returns only changes; adding &wait=<sec> long-polls until there are some
+    # ?q=<text>&filter=<started|unstarted|playing>&limit=<n>&cursor=<next_cursor> pages and
+    # filters the playlist (see build_state); ?frame=<name> picks the frame
+    frame = request_frame()
+    try:
+        view = state_view(request.args)
+    except ValueError as e:
+        return jsonify(success=False, msg=str(e)), 400
+    since = STATE.parse(request.args.get("since"))
+    wait = min(request.args.get("wait", 0, type=float), LONG_POLL_MAX)
+    if since is not None and wait > 0:
+        STATE.wait(since, wait)
+    return jsonify(build_state(since, view, frame))
+
+@app.route("/api/events")
+def api_events():
+    # server-sent events: a full state first (or changes since Last-Event-ID / ?since after a
+    # reconnect), then one delta per change. idle streams only carry a keepalive comment.
+    # takes the same frame/q/filter/limit as /api/state (?limit=0: the client pages in the shows)
+    frame = request_frame()
+    try:
+        view = state_view(request.args)
+    except ValueError as e:
+        return jsonify(success=False, msg=str(e)), 400
+    since = STATE.parse(request.headers.get("Last-Event-ID") or request.args.get("since"))
+    def stream(since):
+        while running:
+            if not STATE.wait(since, SSE_KEEPALIVE):
+                yield ": keepalive\n\n"
+                continue
+            st = build_state(since, view, frame)
+            since = STATE.parse(st["version"])
+            yield f"id: {st['version']}\ndata: {json.dumps(st)}\n\n"
+    return Response(stream(since), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/frames")
+def api_frames():
+    # the frames this process drives, with their Kodi health and what they are playing
+    return jsonify(frames=[{"name": f.name, "kodi": f.kodi.health(), "events_connected": f.events.connected,
+                            "now_playing": f.now_playing["show"], "lux": f.lux.lux()} for f in FRAMES])
 
 @app.route("/api/add", methods=["POST"])
 def api_add():
+    # to the ?frame= playlist, or to every frame's
     show = request.form.get("show","").strip()
     if show and os.path.isdir(os.path.join(ANIME_DIR,show)):
-        db_add_show(show)
+        if request.args.get("frame"): request_frame().queue.add([show])
+        else: db_add_show(show)
         return jsonify(success=True)
     return jsonify(success=False, msg="folder missing"), 400
 
 @app.route("/api/remove/<path:show>", methods=["GET","DELETE"])
 def api_remove(show):
-    db_remove_show(show)
+    # from the ?frame= playlist, or from every frame's
+    db_remove_show(show, request_frame() if request.args.get("frame") else None)
     return jsonify(success=True)
 
 @app.route("/api/start/<path:show>")
 def api_start(show):
-    # move show to front (order_idx = min-1) so playback thread picks it next
-    with DB_LOCK:
-        cur = DB.cursor()
-        cur.execute("SELECT COALESCE(MIN(order_idx),0)-1 FROM shows")
-        new_idx = cur.fetchone()[0]
-        cur.execute("UPDATE shows SET order_idx=? WHERE name=?", (new_idx, show))
-        DB.commit()
+    # move show to front so playback thread picks it next
+    request_frame().queue.move_to_front(show)
     return jsonify(success=True)
 
 @app.route("/api/restart/<path:show>")
 def api_restart(show):
-    with DB_LOCK:
-        DB.execute("UPDATE shows SET episode_index=0, timestamp='00:00:00' WHERE name=?", (show,))
-        # and move it to front
-        cur = DB.cursor(); cur.execute("SELECT COALESCE(MIN(order_idx),0)-1 FROM shows"); new_idx = cur.fetchone()[0]
-        DB.execute("UPDATE shows SET order_idx=? WHERE name=?", (new_idx, show))
-        DB.commit()
+    frame = request_frame()
+    frame.progress.discard(show)
+    # reset and move it to front, in one transaction
+    frame.queue.move_to_front(show, also=[("UPDATE shows SET episode_index=0, position_ms=0 WHERE frame=? AND name=?",
+                                           (frame.name, show))])
     return jsonify(success=True)
 
+@app.route("/api/reorder", methods=["POST"])
+def api_reorder():
+    # {"order": [names...]} sets the whole order in one transaction (unlisted shows keep their
+    # relative order after the listed ones); {"name": .., "position": n} moves a single show,
+    # {"name": .., "before": other} moves it in front of another one
+    q = request_frame().queue
+    data = request.get_json(silent=True) or {}
+    if isinstance(data.get("order"), list):
+        return jsonify(success=True, order=q.reorder([str(n) for n in data["order"]]))
+    if "name" in data and "before" in data:
+        with q.lock:
+            pos, target = q.position(str(data["name"])), q.position(str(data["before"]))
+            if pos is None or target is None:
+                return jsonify(success=False, msg="unknown show"), 404
+            # the show leaves its old spot first
+            q.move_to(str(data["name"]), target - 1 if pos < target else target)
+        return jsonify(success=True)
+    if "name" in data and isinstance(data.get("position"), int):
+        if q.move_to(str(data["name"]), data["position"]):
+            return jsonify(success=True)
+        return jsonify(success=False, msg="unknown show"), 404
+    return jsonify(success=False, msg="expected order list or name/position"), 400
+
+def pause_frame(frame):
+    # save the position of any active player: current file + time in one request
+    path, position_ms = frame.kodi.now_playing()
+    # find which show/episode this path belongs to
+    loc = LIBRARY.locate(path) if path else None
+    if loc:
+        db_update_progress(frame, loc[0], loc[1], position_ms)
+    frame.kodi.pause()
+
 @app.route("/api/pause")
 def api_pause():
-    # save timestamp for any active player
-    players = kodi_get_active_player()
-    if players:
-        # save the current file name -> map it to DB show row
-        # get currently playing item
-        res = kodi_rpc("Player.GetItem", {"playerid": players[0]["playerid"], "properties":["file"]})
-        path = res.get("result",{}).get("item",{}).get("file")
-        if path:
-            # find which show this path belongs to
-            for show in list_shows_on_disk():
-                if os.path.commonpath([os.path.abspath(path), os.path.abspath(os.path.join(ANIME_DIR,show))]) == os.path.abspath(os.path.join(ANIME_DIR,show)):
-                    cur_time = kodi_get_time()
-                    # find index of this file in show's videos
-                    vids = build_video_list(show)
-                    try:
-                        idx = vids.index(path)
-                    except ValueError:
-                        idx = 0
-                    db_update_progress(show, idx, cur_time)
-                    break
-    kodi_pause()
+    # ?frame=all pauses every frame that is online, all at once
+    if request.args.get("frame") == "all":
+        up = [f for f in FRAMES if f.kodi.up]
+        each_frame(pause_frame, up)
+        return jsonify(success=True, paused=[f.name for f in up], offline=[f.name for f in FRAMES if f not in up])
+    frame = request_frame()
+    if not frame.kodi.up:
+        return jsonify(success=False, msg="Kodi is offline"), 503
+    pause_frame(frame)
     return jsonify(success=True)
 
 @app.route("/api/refresh")
 def api_refresh():
-    # sync disk shows into DB without removing existing
-    disk = list_shows_on_disk()
-    for s in disk:
-        db_add_show(s)
-    return jsonify(success=True)
+    # incremental library sync (?full=1 re-lists every folder), then add new disk shows to the
+    # playlist without removing existing
+    diff = LIBRARY.sync(full=request.args.get("full") == "1")
+    diff["playlist_added"] = db_add_shows(list_shows_on_disk())
+    THUMBS.pregenerate(diff["added_shows"] + diff["playlist_added"])
+    PROBES.pregenerate(diff["added_shows"] + diff["playlist_added"])
+    return jsonify(success=True, **diff)
+
+@app.route("/api/lux/history")
+def api_lux_history():
+    # recent raw samples ([unix time, lux or null]), optionally only the last ?seconds=N
+    lux = request_frame().lux
+    seconds = request.args.get("seconds", type=float)
+    return jsonify(interval=lux.interval, lux=lux.lux(), bright=lux.bright(),
+                   threshold=lux.threshold, hysteresis=lux.hysteresis,
+                   samples=[[round(t, 3), round(v, 1) if v is not None else None] for t,v in lux.history(seconds)])
+
+@app.route("/api/stats")
+def api_stats():
+    return jsonify(progress_journal=request_frame().progress.stats, probes=PROBES.stats())
+
+@app.route("/api/episodes/<path:show>")
+def api_episodes(show):
+    # the show's episodes with their probed duration and streams
+    if show not in list_shows_on_disk():
+        return jsonify(success=False, msg="unknown show"), 404
+    return jsonify(success=True, episodes=PROBES.episodes(show))
 
 @app.route("/api/settings", methods=["POST"])
 def api_settings():
+    frame = request_frame()
     data = request.get_json()
-    db_set_setting("use_light", "1" if data.get("use_light") else "0")
-    db_set_setting("schedule_enabled", "1" if data.get("schedule_enabled") else "0")
-    db_set_setting("schedule_start", data.get("schedule_start") or "08:00")
-    db_set_setting("schedule_end", data.get("schedule_end") or "23:00")
+    values = {
+        "use_light": "1" if data.get("use_light") else "0",
+        "schedule_enabled": "1" if data.get("schedule_enabled") else "0",
+        "schedule_start": data.get("schedule_start") or "08:00",
+        "schedule_end": data.get("schedule_end") or "23:00"}
+    if "schedule_windows" in data:
+        values["schedule_windows"] = (data.get("schedule_windows") or "").strip()
+    try:
+        parse_schedule_windows(f"{values['schedule_start']}-{values['schedule_end']}")
+        parse_schedule_windows(values.get("schedule_windows"))
+    except ValueError as e:
+        return jsonify(success=False, msg=f"bad schedule: {e}"), 400
+    frame.update_settings(values)
     return jsonify(success=True)
 
 # ---------------- signal handling ----------------
 def clean_exit(signum, frame):
     global running
     running = False
-    # attempt a final timestamp save if playing
+    # attempt a final position save on every frame that is playing (all Kodis asked at once)
+    def save(f):
+        try:
+            path, position_ms = f.kodi.now_playing()
+            loc = LIBRARY.locate(path) if path else None
+            if loc:
+                f.progress.record(loc[0], loc[1], position_ms)
+        except Exception:
+            pass
+        # write out buffered progress before exiting
+        try:
+            f.progress.flush()
+        except Exception:
+            pass
+    each_frame(save)
     try:
-        players = kodi_get_active_player()
-        if players:
-            res = kodi_rpc("Player.GetItem", {"playerid": players[0]["playerid"], "properties":["file"]})
-            path = res.get("result",{}).get("item",{}).get("file")
-            cur_time = kodi_get_time()
-            if path:
-                for show in list_shows_on_disk():
-                    if os.path.commonpath([os.path.abspath(path), os.path.abspath(os.path.join(ANIME_DIR,show))]) == os.path.abspath(os.path.join(ANIME_DIR,show)):
-                        vids = build_video_list(show)
-                        try:
-                            idx = vids.index(path)
-                        except ValueError:
-                            idx = 0
-                        db_update_progress(show, idx, cur_time)
-                        break
+        PROBES.flush()
     except Exception:
         pass
     sys.exit(0)
@@ -538,9 +2482,14 @@ if __name__ == "__main__":
         from PIL import Image, ImageDraw, ImageFont
         img = Image.new("RGBA",(400,225),(20,30,40,255))
         img.save(os.path.join(STATIC_DIR,"fallback.png"))
+    # restore the library snapshot and rescan only folders changed since the last run
+    LIBRARY.load()
+    LIBRARY.sync()
     # seed DB from disk for any shows not present
-    for s in list_shows_on_disk():
-        db_add_show(s)
-    t = threading.Thread(target=playback_thread, daemon=True)
-    t.start()
+    db_add_shows(list_shows_on_disk())
+    THUMBS.pregenerate(list_shows_on_disk())
+    PROBES.pregenerate(list_shows_on_disk())
+    # sensor, notifications and a playback thread per frame
+    for f in FRAMES:
+        f.start()
     app.run(host="0.0.0.0", port=FLASK_PORT)
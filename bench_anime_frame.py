@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+"""
+Anime Frame benchmarks
+- builds a synthetic ANIME_DIR (empty video files + a poster per show), reused between runs
+- runs a fake Kodi (JSON-RPC over HTTP + TCP notifications, virtual clock) in a child process,
+  one per frame with --frames N (ports counting up from --kodi-port / --events-port)
+- replaces smbus2 with a fake BH1750, so no I2C is needed
+- times startup to first request, the poster and ffprobe backlogs, /api/state, /api/pause,
+  /api/refresh, /poster cold and warm
+  and a simulated day of the playback loop, and prints the results as JSON
+
+usage: python3 bench_anime_frame.py [--shows 2000 --episodes 100000] [--frames 1] [--out run.json] [--compare old.json]
+"""
+
+import os, sys, json, time, types, socket, signal, argparse, threading, subprocess, collections, multiprocessing, platform, random, statistics, tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(HERE, "anime_frame.py")
+EPISODE_SECS = 24*60   # virtual length of every fake episode
+
+# ---------------- fake BH1750 ----------------
+class FakeSMBus:
+    # stands in for smbus2.SMBus; `source` (a callable returning lux) replaces the fixed level
+    lux = 200.0
+    source = None
+
+    def __init__(self, bus=1):
+        pass
+
+    def read_i2c_block_data(self, addr, cmd, length):
+        lux = FakeSMBus.source() if FakeSMBus.source else FakeSMBus.lux
+        raw = max(0, min(65535, int(lux*1.2)))
+        return [raw >> 8, raw & 0xff]
+
+    def close(self):
+        pass
+
+def install_fake_smbus():
+    mod = types.ModuleType("smbus2")
+    mod.SMBus = FakeSMBus
+    sys.modules["smbus2"] = mod
+
+# ---------------- fake Kodi ----------------
+def _kodi_time(secs):
+    secs = int(secs)
+    return {"hours": secs//3600, "minutes": secs//60 % 60, "seconds": secs % 60, "milliseconds": 0}
+
+class FakeKodi:
+    # one video player with a playlist. playback runs on a virtual clock `speed` times faster
+    # than real time; items that reach the end send Player.OnStop(end) and the next one starts,
+    # like Kodi. Bench.* methods control it from the benchmark process
+    def __init__(self, speed=1.0):
+        self.lock = threading.RLock()
+        self.clients = []
+        self.reset(speed)
+
+    def reset(self, speed=1.0):
+        with self.lock:
+            self.speed, self.t0 = speed, time.monotonic()
+            self.playlist, self.pos, self.file = [], 0, None
+            self.start, self.paused_at = 0.0, None
+            self.calls = collections.Counter()
+            self.played = 0
+
+    def now(self):
+        return (time.monotonic() - self.t0) * self.speed
+
+    def position(self):
+        if self.file is None: return 0
+        p = self.paused_at if self.paused_at is not None else self.now() - self.start
+        return max(0, min(EPISODE_SECS, p))
+
+    def notify(self, method, data):
+        msg = json.dumps({"jsonrpc":"2.0","method":method,"params":{"sender":"xbmc","data":data}}).encode()
+        for c in list(self.clients):
+            try:
+                c.sendall(msg)
+            except OSError:
+                self.clients.remove(c)
+
+    def _play(self, path):
+        self.file, self.start, self.paused_at = path, self.now(), None
+        item = {"item": {"type": "episode", "file": path}, "player": {"playerid": 1, "speed": 1}}
+        def started():
+            self.notify("Player.OnPlay", item)
+            self.notify("Player.OnAVStart", item)
+        threading.Timer(0.01, started).start()
+
+    def tick(self):
+        while True:
+            time.sleep(0.005)
+            with self.lock:
+                if self.file is None or self.paused_at is not None or self.now() - self.start < EPISODE_SECS: continue
+                self.played += 1
+                self.notify("Player.OnStop", {"item": {"type": "episode"}, "end": True})
+                if self.pos + 1 < len(self.playlist):
+                    self.pos += 1
+                    self._play(self.playlist[self.pos])
+                else:
+                    self.file = None
+
+    def handle(self, req):
+        m, p = req.get("method"), req.get("params") or {}
+        with self.lock:
+            if not m.startswith("Bench."): self.calls[m] += 1
+            r = self._handle(m, p)
+        if isinstance(r, Exception):
+            return {"jsonrpc":"2.0","id":req.get("id"),"error":{"code":-32100,"message":str(r)}}
+        return {"jsonrpc":"2.0","id":req.get("id"),"result":r}
+
+    def _handle(self, m, p):
+        if m == "JSONRPC.Ping": return "pong"
+        if m == "Player.GetActivePlayers":
+            return [{"playerid":1,"playertype":"internal","type":"video"}] if self.file else []
+        if m in ("Player.GetProperties","Player.GetItem","Player.Seek","Player.PlayPause","Player.Stop") and self.file is None:
+            return Exception("Failed to execute method.")
+        if m == "Player.GetProperties":
+            props = {"time": _kodi_time(self.position()), "totaltime": _kodi_time(EPISODE_SECS),
+                     "percentage": 100.0*self.position()/EPISODE_SECS, "position": self.pos,
+                     "speed": 0 if self.paused_at is not None else 1}
+            return {k: props[k] for k in p.get("properties", []) if k in props}
+        if m == "Player.GetItem": return {"item": {"type": "episode", "file": self.file}}
+        if m == "Player.Open":
+            item = p.get("item", {})
+            if "playlistid" in item:
+                self.pos = item.get("position", 0)
+                if self.pos >= len(self.playlist): return Exception("Invalid params.")
+            else:
+                self.playlist, self.pos = [item.get("file")], 0
+            self._play(self.playlist[self.pos])
+            return "OK"
+        if m == "Player.PlayPause":
+            play = p.get("play", "toggle")
+            if play == "toggle": play = self.paused_at is not None
+            if play and self.paused_at is not None:
+                self.start, self.paused_at = self.now() - self.paused_at, None
+            elif not play and self.paused_at is None:
+                self.paused_at = self.position()
+                self.notify("Player.OnPause", {"player": {"playerid": 1, "speed": 0}})
+            return {"speed": 0 if self.paused_at is not None else 1}
+        if m == "Player.Seek":
+            v = p.get("value", {})
+            t = v.get("time", v)
+            secs = t.get("hours",0)*3600 + t.get("minutes",0)*60 + t.get("seconds",0)
+            if self.paused_at is not None: self.paused_at = secs
+            else: self.start = self.now() - secs
+            return {"time": _kodi_time(secs)}
+        if m == "Player.Stop":
+            self.file = None
+            self.notify("Player.OnStop", {"item": {"type": "episode"}, "end": False})
+            return "OK"
+        if m == "Playlist.Clear":
+            self.playlist, self.pos = [], 0
+            return "OK"
+        if m == "Playlist.Add":
+            self.playlist.append(p["item"]["file"])
+            return "OK"
+        if m == "Playlist.Remove":
+            i = p.get("position", 0)
+            if i >= len(self.playlist) or (self.file is not None and i == self.pos): return Exception("Invalid params.")
+            del self.playlist[i]
+            if i < self.pos: self.pos -= 1
+            return "OK"
+        # benchmark control
+        if m == "Bench.Reset":
+            self.reset(p.get("speed", 1.0))
+            return "OK"
+        if m == "Bench.Play":
+            self.playlist, self.pos = [p["file"]], 0
+            self.file, self.start, self.paused_at = p["file"], self.now() - p.get("at", 0), None
+            return "OK"
+        if m == "Bench.Stats":
+            return {"calls": dict(self.calls), "played": self.played, "virtual_secs": self.now(),
+                    "playlist": list(self.playlist), "position": self.pos}
+        return "OK"
+
+def serve_fake_kodi(http_port, events_port, delay=0.0):
+    # delay: sec added to every JSON-RPC request (not Bench.*), to play a slow Kodi
+    kodi = FakeKodi()
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # headers and body go out separately; don't wait for ACKs
+        def log_message(self, *a): pass
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if delay and not any(x.get("method", "").startswith("Bench.") for x in (body if isinstance(body, list) else [body])):
+                time.sleep(delay)
+            out = [kodi.handle(x) for x in body] if isinstance(body, list) else kodi.handle(body)
+            data = json.dumps(out).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+    srv = socket.socket()
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", events_port))
+    srv.listen()
+    def accept():
+        while True:
+            c, _ = srv.accept()
+            with kodi.lock:
+                kodi.clients.append(c)
+    threading.Thread(target=accept, daemon=True).start()
+    threading.Thread(target=kodi.tick, daemon=True).start()
+    ThreadingHTTPServer.allow_reuse_address = True
+    ThreadingHTTPServer(("127.0.0.1", http_port), Handler).serve_forever()
+
+class KodiControl:
+    def __init__(self, port):
+        self.url = f"http://127.0.0.1:{port}/jsonrpc"
+        self.session = requests.Session()
+
+    def __call__(self, method, params=None):
+        return self.session.post(self.url, json={"jsonrpc":"2.0","id":1,"method":method,"params":params or {}}, timeout=5).json().get("result")
+
+def wait_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.02)
+    raise RuntimeError(f"nothing listening on port {port}")
+
+# ---------------- synthetic library ----------------
+def make_poster(path):
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError:
+        with open(path, "wb") as f: f.write(b"\xff\xd8\xff\xd9")
+        return
+    img = Image.new("RGB", (600, 850), (40, 60, 90))
+    ImageDraw.Draw(img).rectangle((60, 60, 540, 790), outline=(220, 220, 220), width=8)
+    img.save(path, quality=85)
+
+def build_library(root, shows, episodes):
+    # "Show 00000".. with episodes spread evenly; every 4th show keeps them in 3 season folders.
+    # all files are empty; posters are hard links to one JPEG. reused if the sizes match
+    marker = os.path.join(root, ".bench-library")
+    spec = f"{shows} {episodes}"
+    if os.path.exists(marker) and open(marker).read() == spec: return 0.0
+    t = time.perf_counter()
+    if os.path.exists(root): subprocess.run(["rm", "-rf", root], check=True)
+    os.makedirs(root)
+    master = os.path.join(root, ".poster.jpg")
+    make_poster(master)
+    for i in range(shows):
+        name = f"Show {i:05d}"
+        top = os.path.join(root, name)
+        n = episodes // shows + (1 if i < episodes % shows else 0)
+        seasons = 3 if i % 4 == 0 else 1
+        dirs = [os.path.join(top, f"Season {s+1}") for s in range(seasons)] if seasons > 1 else [top]
+        for d in dirs: os.makedirs(d, exist_ok=True)
+        for e in range(n):
+            open(os.path.join(dirs[e*seasons//max(n,1)], f"{name} - E{e+1:04d}.mkv"), "wb").close()
+        os.link(master, os.path.join(top, "poster.jpg"))
+    with open(marker, "w") as f: f.write(spec)
+    return time.perf_counter() - t
+
+def add_cold_shows(root, count):
+    # extra shows with posters nothing has looked at yet (for /poster cold)
+    names = []
+    for i in range(count):
+        name = f"Cold {i:03d} {os.getpid()}"
+        os.makedirs(os.path.join(root, name))
+        open(os.path.join(root, name, f"{name} - E0001.mkv"), "wb").close()
+        os.link(os.path.join(root, ".poster.jpg"), os.path.join(root, name, "poster.jpg"))
+        names.append(name)
+    return names
+
+def remove_cold_shows(root, names):
+    for name in names: subprocess.run(["rm", "-rf", os.path.join(root, name)], check=False)
+
+# ---------------- timing helpers ----------------
+def summary(samples):
+    ms = sorted(x*1000 for x in samples)
+    return {"n": len(ms), "min_ms": round(ms[0], 3), "median_ms": round(statistics.median(ms), 3),
+            "p95_ms": round(ms[min(len(ms)-1, int(len(ms)*0.95))], 3), "mean_ms": round(statistics.fmean(ms), 3),
+            "max_ms": round(ms[-1], 3)}
+
+def timed(fn, n, setup=None, warmup=1):
+    for _ in range(warmup):
+        if setup: setup()
+        fn()
+    out = []
+    for _ in range(n):
+        if setup: setup()
+        t = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t)
+    return summary(out)
+
+def check(resp, *codes):
+    if resp.status_code not in (codes or (200,)): raise RuntimeError(f"{resp.request.path}: HTTP {resp.status_code}")
+    return resp
+
+# ---------------- benchmarks ----------------
+def app_env(args, work, tag):
+    env = dict(os.environ)
+    env.update({"ANIME_FRAME_ANIME_DIR": args.library,
+                "ANIME_FRAME_STATIC_DIR": os.path.join(work, f"static-{tag}"),
+                "ANIME_FRAME_DB_FILE": os.path.join(work, f"{tag}.db"),
+                "ANIME_FRAME_KODI_URL": f"http://127.0.0.1:{args.kodi_port}/jsonrpc",
+                "ANIME_FRAME_KODI_EVENTS_HOST": "127.0.0.1",
+                "ANIME_FRAME_KODI_EVENTS_PORT": str(args.events_port),
+                "ANIME_FRAME_FLASK_PORT": str(args.flask_port)})
+    if args.frames > 1:
+        env["ANIME_FRAME_FRAMES"] = json.dumps([
+            {"name": f"frame{i}", "kodi_url": f"http://127.0.0.1:{args.kodi_port + i}/jsonrpc",
+             "events_host": "127.0.0.1", "events_port": args.events_port + i} for i in range(args.frames)])
+    return env
+
+def bench_startup(args, work):
+    # run the real script (fake smbus2) and time until /api/state answers: first with an empty
+    # DB (full library scan), then again with the snapshot it left behind
+    boot = f"import sys, runpy; sys.path.insert(0, {HERE!r}); import bench_anime_frame as b; b.install_fake_smbus(); runpy.run_path({APP!r}, run_name='__main__')"
+    env = app_env(args, work, "startup")
+    url = f"http://127.0.0.1:{args.flask_port}/api/state"
+    out = {}
+    for kind in ("cold", "warm"):
+        t = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "-c", boot], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                if proc.poll() is not None: raise RuntimeError("anime_frame.py exited during startup")
+                try:
+                    if requests.get(url, timeout=1).status_code == 200: break
+                except requests.RequestException:
+                    time.sleep(0.01)
+            out[kind + "_ms"] = round((time.perf_counter() - t)*1000, 1)
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    return out
+
+def bench_app(args, work, kodis):
+    # everything else runs against the app imported into this process (Flask test client)
+    kodi = kodis[0]
+    os.environ.update(app_env(args, work, "app"))
+    install_fake_smbus()
+    t = time.perf_counter()
+    sys.path.insert(0, HERE)
+    import anime_frame as af
+    res = {"import_ms": round((time.perf_counter() - t)*1000, 1)}
+    os.makedirs(af.STATIC_DIR, exist_ok=True)
+    make_poster(os.path.join(af.STATIC_DIR, "fallback.png"))
+    c = af.app.test_client()
+    n = args.repeat
+
+    # first refresh on an empty DB: full scan + playlist seeding, then the poster backlog it queued
+    t = time.perf_counter()
+    first = check(c.get("/api/refresh")).json
+    res["refresh_initial_ms"] = round((time.perf_counter() - t)*1000, 1)
+    res["library"] = {"shows": len(first["added_shows"]), "episodes": sum(len(v) for v in first["added_episodes"].values())}
+    t = time.perf_counter()
+    while af.THUMBS.pending and time.perf_counter() - t < args.backlog_timeout: time.sleep(0.05)
+    res["poster_backlog_ms"] = round((time.perf_counter() - t)*1000, 1)
+    # ffprobe of every episode (empty files: each run fails fast; durations stay unknown)
+    t = time.perf_counter()
+    while af.PROBES.pending and time.perf_counter() - t < args.backlog_timeout: time.sleep(0.05)
+    res["probe_backlog_ms"] = round((time.perf_counter() - t)*1000, 1)
+    res["probes"] = af.PROBES.stats()
+
+    res["refresh_incremental"] = timed(lambda: check(c.get("/api/refresh")), n)
+    res["refresh_full"] = timed(lambda: check(c.get("/api/refresh?full=1")), max(3, n//10))
+
+    res["state_full"] = timed(lambda: check(c.get("/api/state")), n)
+    res["state_page"] = timed(lambda: check(c.get("/api/state?limit=120")), n)
+    res["state_search"] = timed(lambda: check(c.get("/api/state?q=show 01&limit=120")), n)
+    version = c.get("/api/state").json["version"]
+    res["state_delta"] = timed(lambda: check(c.get(f"/api/state?since={version}")), n)
+
+    # /api/pause with Kodi part way through a random episode
+    rnd = random.Random(1)
+    shows = af.list_shows_on_disk()
+    res["pause"] = timed(lambda: check(c.get("/api/pause")), n,
+                         setup=lambda: kodi("Bench.Play", {"file": rnd.choice(af.build_video_list(rnd.choice(shows))), "at": 600}))
+    kodi("Bench.Reset")
+    if len(kodis) > 1:
+        # every frame at once (one of them possibly slow, --slow-kodi-ms)
+        def play_all():
+            for k in kodis: k("Bench.Play", {"file": rnd.choice(af.build_video_list(rnd.choice(shows))), "at": 600})
+        res["pause_all"] = timed(lambda: check(c.get("/api/pause?frame=all")), n, setup=play_all)
+        for k in kodis: k("Bench.Reset")
+
+    # /poster: cold = shows no one asked for yet (first answer is the fallback while the variant
+    # is made; ready = until the variant is served), warm = versioned URL and a 304 revalidation
+    cold = add_cold_shows(args.library, args.cold_posters)
+    try:
+        af.LIBRARY.sync()
+        first_ms, ready_ms = [], []
+        for name in cold:
+            t = time.perf_counter()
+            r = check(c.get(f"/poster/{name}"))
+            first_ms.append(time.perf_counter() - t)
+            while "no-store" in r.headers.get("Cache-Control", "") and time.perf_counter() - t < 30:
+                time.sleep(0.002)
+                r = check(c.get(f"/poster/{name}"))
+            ready_ms.append(time.perf_counter() - t)
+        res["poster_cold_first"] = summary(first_ms)
+        res["poster_cold_ready"] = summary(ready_ms)
+    finally:
+        remove_cold_shows(args.library, cold)
+        af.LIBRARY.sync()
+    url = c.get("/api/state").json["playlist"][0]["poster"]
+    res["poster_warm"] = timed(lambda: check(c.get(url)), n)
+    etag = c.get(url).headers.get("ETag")
+    res["poster_warm_304"] = timed(lambda: check(c.get(url, headers={"If-None-Match": etag}), 304), n)
+    res["metrics"] = timed(lambda: check(c.get("/metrics")), n)
+
+    if args.day_seconds: res["day"] = bench_day(args, af, kodis)
+    return res
+
+def bench_day(args, af, kodis):
+    # 24 virtual hours in args.day_seconds: Kodi's clock and the light sensor are sped up
+    # (dark 23:00-07:00), episodes are 24 virtual minutes. counts what the playback loops cost;
+    # every frame plays at once, and per_frame shows whether a slow one held up the others
+    speed = 86400.0 / args.day_seconds
+    t0 = time.monotonic()
+    for k in kodis: k("Bench.Reset", {"speed": speed})
+    hour = lambda: ((time.monotonic() - t0) * speed / 3600) % 24
+    FakeSMBus.source = lambda: 200.0 if 7 <= hour() < 23 else 2.0
+    for sensor in af.SENSORS.values():
+        sensor.interval = 60 / speed    # one sample per virtual minute
+    db_before = dict(af.M_DB_TX.values)
+    cpu, wall = time.process_time(), time.perf_counter()
+    for f in af.FRAMES:
+        f.start()
+    time.sleep(args.day_seconds)
+    stats = [k("Bench.Stats") for k in kodis]
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    af.running = False
+    commits = af.M_DB_TX.values.get(("commit",), 0) - db_before.get(("commit",), 0)
+    calls = collections.Counter()
+    for st in stats: calls.update(st["calls"])
+    out = {"virtual_hours": round(stats[0]["virtual_secs"]/3600, 2), "episodes_finished": sum(st["played"] for st in stats),
+           "kodi_requests": sum(calls.values()), "kodi_calls": dict(calls),
+           "db_commits": commits, "cpu_s": round(cpu, 3), "cpu_pct": round(100*cpu/wall, 2)}
+    if len(kodis) > 1:
+        out["per_frame"] = {f.name: {"episodes_finished": st["played"], "kodi_requests": sum(st["calls"].values())}
+                            for f,st in zip(af.FRAMES, stats)}
+    return out
+
+def compare(old, new, path=""):
+    # median (or single value) ratios new/old for every timing present in both runs
+    out = {}
+    for k,v in new.items():
+        o = old.get(k) if isinstance(old, dict) else None
+        if isinstance(v, dict) and "median_ms" in v and isinstance(o, dict) and o.get("median_ms"):
+            out[path + k] = round(v["median_ms"] / o["median_ms"], 3)
+        elif isinstance(v, dict) and isinstance(o, dict):
+            out.update(compare(o, v, path + k + "."))
+        elif k.endswith("_ms") and isinstance(v, (int, float)) and isinstance(o, (int, float)) and o:
+            out[path + k] = round(v / o, 3)
+    return out
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--shows", type=int, default=2000)
+    ap.add_argument("--episodes", type=int, default=100000)
+    ap.add_argument("--library", help="synthetic ANIME_DIR (default: in the temp dir, kept for the next run)")
+    ap.add_argument("--repeat", type=int, default=50, help="samples per timed request")
+    ap.add_argument("--cold-posters", type=int, default=10)
+    ap.add_argument("--backlog-timeout", type=float, default=600)
+    ap.add_argument("--day-seconds", type=float, default=60, help="real seconds for the simulated day (0 to skip)")
+    ap.add_argument("--skip-startup", action="store_true")
+    ap.add_argument("--frames", type=int, default=1, help="frames (fake Kodis) driven by the one app process")
+    ap.add_argument("--slow-kodi-ms", type=float, default=0, help="delay every request to the last frame's Kodi by this much")
+    ap.add_argument("--kodi-port", type=int, default=18080)
+    ap.add_argument("--events-port", type=int, default=19090)
+    ap.add_argument("--flask-port", type=int, default=15000)
+    ap.add_argument("--out", help="also write the JSON results here")
+    ap.add_argument("--compare", help="earlier results file; adds new/old median ratios")
+    args = ap.parse_args()
+    args.library = args.library or os.path.join(tempfile.gettempdir(), f"animeframe-bench-{args.shows}-{args.episodes}")
+
+    build_s = build_library(args.library, args.shows, args.episodes)
+    kodi_procs = []
+    for i in range(args.frames):
+        delay = args.slow_kodi_ms/1000 if i == args.frames - 1 and args.frames > 1 else 0
+        kodi_procs.append(multiprocessing.Process(target=serve_fake_kodi, args=(args.kodi_port + i, args.events_port + i, delay), daemon=True))
+        kodi_procs[-1].start()
+    for i in range(args.frames): wait_port(args.kodi_port + i)
+    kodis = [KodiControl(args.kodi_port + i) for i in range(args.frames)]
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="animeframe-bench-") as work:
+        try:
+            if not args.skip_startup: results["startup"] = bench_startup(args, work)
+            results.update(bench_app(args, work, kodis))
+        finally:
+            for proc in kodi_procs: proc.terminate()
+    try:
+        commit = subprocess.run(["git", "-C", HERE, "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    report = {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit, "python": platform.python_version(),
+                       "machine": platform.machine(), "shows": args.shows, "episodes": args.episodes, "frames": args.frames,
+                       "repeat": args.repeat, "day_seconds": args.day_seconds, "library_build_s": round(build_s, 2)},
+              "results": results}
+    if args.compare:
+        with open(args.compare) as f: report["ratio_vs_" + os.path.basename(args.compare)] = compare(json.load(f)["results"], results)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f: f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,626 @@
+#!/usr/bin/env python3
+"""
+Anime Frame tests
+- run anime_frame against a temporary library and DB, the benchmark's fake Kodi (JSON-RPC +
+  TCP notifications, virtual clock) and its fake BH1750, so no Pi, Kodi or I2C is needed
+
+usage: python3 -m pytest -q test_anime_frame.py
+"""
+
+import os, sys, json, time, types, shutil, socket, sqlite3, tempfile, threading
+import pytest, requests
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+WORK = tempfile.mkdtemp(prefix="animeframe-test-")
+# (JSON-RPC, notification) ports of each frame's fake Kodi: "default" and "hall"
+KODI_PORTS = [(_free_port(), _free_port()) for _ in range(2)]
+(KODI_PORT, EVENTS_PORT), (HALL_PORT, HALL_EVENTS_PORT) = KODI_PORTS
+os.environ.update({"ANIME_FRAME_ANIME_DIR": os.path.join(WORK, "anime"),
+                   "ANIME_FRAME_STATIC_DIR": os.path.join(WORK, "static"),
+                   "ANIME_FRAME_DB_FILE": os.path.join(WORK, "test.db"),
+                   "ANIME_FRAME_KODI_URL": f"http://127.0.0.1:{KODI_PORT}/jsonrpc",
+                   "ANIME_FRAME_KODI_EVENTS_HOST": "127.0.0.1",
+                   "ANIME_FRAME_KODI_EVENTS_PORT": str(EVENTS_PORT),
+                   # the hall frame's notifications come from the host in its kodi_url
+                   "ANIME_FRAME_FRAMES": json.dumps([{"name": "default"}, {"name": "hall",
+                       "kodi_url": f"http://127.0.0.1:{HALL_PORT}/jsonrpc", "events_port": HALL_EVENTS_PORT}])})
+os.makedirs(os.environ["ANIME_FRAME_ANIME_DIR"])
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bench_anime_frame as bench
+bench.install_fake_smbus()
+import anime_frame as af
+
+@pytest.fixture(scope="session", autouse=True)
+def work_dir():
+    # the library and DB are made before anime_frame is imported (it reads the paths then);
+    # removed once the run is over
+    yield WORK
+    shutil.rmtree(WORK, ignore_errors=True)
+
+def wait_until(cond, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if cond(): return True
+        time.sleep(0.02)
+    return False
+
+@pytest.fixture(scope="session")
+def kodis():
+    # a fake Kodi per frame; returns their KodiControls (Bench.* resets and inspects them)
+    for frame, (http, events) in zip(af.FRAMES, KODI_PORTS):
+        threading.Thread(target=bench.serve_fake_kodi, args=(http, events), daemon=True).start()
+        bench.wait_port(http)
+        frame.events.start()
+    assert wait_until(lambda: all(f.events.connected for f in af.FRAMES))
+    return [bench.KodiControl(http) for http,_ in KODI_PORTS]
+
+@pytest.fixture
+def kodi(kodis):
+    # the first frame's
+    return kodis[0]
+
+# ---------------- Kodi notifications ----------------
+def read_chunks(chunks):
+    # feed raw chunks through KodiEvents._read; returns the (method, data) notifications seen
+    events = af.KodiEvents("127.0.0.1", None)
+    a, b = socket.socketpair()
+    reader = threading.Thread(target=events._read, args=(a,))
+    reader.start()
+    for c in chunks:
+        b.sendall(c)
+        time.sleep(0.01)
+    b.close()
+    reader.join(5)
+    a.close()
+    return [(m, d) for _,m,d in events.history]
+
+def note(method, **data):
+    return json.dumps({"jsonrpc": "2.0", "method": method, "params": {"sender": "xbmc", "data": data}}, ensure_ascii=False).encode()
+
+def test_events_back_to_back_objects():
+    stream = note("Player.OnPlay", a=1) + note("Player.OnPause") + b"\n " + note("Player.OnStop", end=True)
+    assert read_chunks([stream]) == [("Player.OnPlay", {"a": 1}), ("Player.OnPause", {}), ("Player.OnStop", {"end": True})]
+
+def test_events_split_objects():
+    # objects (and a multi-byte character) cut across reads
+    stream = note("Player.OnPlay", title="日本") + note("Player.OnStop", end=False)
+    cuts = [0, 5, stream.index("日".encode()) + 1, len(stream) - 3, len(stream)]
+    seen = read_chunks([stream[a:b] for a,b in zip(cuts, cuts[1:])])
+    assert seen == [("Player.OnPlay", {"title": "日本"}), ("Player.OnStop", {"end": False})]
+
+def test_events_skip_responses():
+    # replies to our own requests (they carry an id) aren't notifications
+    stream = json.dumps({"jsonrpc": "2.0", "id": 1, "result": "OK"}).encode() + note("Player.OnAVStart")
+    assert read_chunks([stream]) == [("Player.OnAVStart", {})]
+
+def test_wait_for():
+    events = af.KodiEvents("127.0.0.1", None)
+    events._dispatch("Player.OnPlay", {})
+    since = events.seq
+    assert events.wait_for(("Player.OnPlay",), since, 0) is None
+    threading.Timer(0.1, events._dispatch, ("Player.OnStop", {"end": True})).start()
+    threading.Timer(0.2, events._dispatch, ("Player.OnAVStart", {"player": {"playerid": 1}})).start()
+    t = time.monotonic()
+    seq, method, data = events.wait_for(("Player.OnAVStart",), since, 5)
+    assert method == "Player.OnAVStart" and seq == since + 2 and 0.1 < time.monotonic() - t < 2
+    # earlier notifications stay available to a later wait
+    assert events.wait_for(("Player.OnStop",), since, 0)[2] == {"end": True}
+    assert events.wait_for(("Player.OnStop",), seq, 0.05) is None
+
+def test_play_queue_resumes_on_avstart(kodi):
+    # playback starts through the playlist as [playing, next] and seeks to the saved position
+    # once the stream has started
+    kodi("Bench.Reset")
+    frame = af.FRAMES[0]
+    since = frame.events.seq
+    frame.kodi.play_queue("/x/ep1.mkv", 90000, "/x/ep2.mkv")
+    assert frame.events.wait_for(("Player.OnAVStart",), since, 0)
+    st = frame.kodi.status(properties=("time","position"))
+    assert 90000 <= af._kodi_ms(st["time"]) < 95000 and st["position"] == 0
+    stats = kodi("Bench.Stats")
+    assert stats["playlist"] == ["/x/ep1.mkv", "/x/ep2.mkv"] and stats["calls"]["Player.Seek"] == 1
+    kodi("Player.Stop", {"playerid": 1})
+
+# ---------------- Kodi circuit breaker ----------------
+def spare_frame(name):
+    # a frame outside FRAMES (never started) with a Kodi nobody listens on
+    frame = af.Frame(name, prefix=name + "/", kodi_url=f"http://127.0.0.1:{_free_port()}/jsonrpc", events_port=None)
+    frame.kodi.probe = (0.05, 0.1)
+    return frame
+
+def fake_send(monkeypatch, kodi, answers):
+    # kodi answers (True) or fails (False) each request in turn; the probe loop included
+    answers = iter(answers)
+    def send(payload, timeout):
+        if not next(answers, True): raise requests.ConnectionError("refused")
+        return [] if isinstance(payload, list) else {"jsonrpc": "2.0", "id": payload["id"], "result": "pong"}
+    monkeypatch.setattr(kodi, "_send", send)
+
+def test_breaker_trips_after_failures_in_a_row(monkeypatch):
+    kodi = af.KodiClient("http://127.0.0.1:9/jsonrpc", probe=(60, 60), name="trip")
+    changes = []
+    kodi.listeners.append(changes.append)
+    n = af.KODI_BREAKER_FAILURES
+    # a success in between resets the count
+    fake_send(monkeypatch, kodi, [False]*(n-1) + [True] + [False]*n)
+    for _ in range(n):
+        kodi.call("JSONRPC.Ping")
+    assert kodi.up and kodi.errors == 0
+    for _ in range(n-1):
+        kodi.call("JSONRPC.Ping")
+    assert kodi.up and kodi.errors == n-1
+    kodi.call("JSONRPC.Ping")
+    assert not kodi.up and changes == [False] and kodi.health()["error"] == "ConnectionError: refused"
+    # while open, calls fail fast without a request
+    assert kodi.call("Player.GetActivePlayers") == {} and kodi.status() is None
+    calls = af.M_KODI_CALLS.values
+    assert calls[("trip", "JSONRPC.Ping", "failed")] == 2*n - 1 and calls[("trip", "JSONRPC.Ping", "ok")] == 1
+    assert calls[("trip", "Player.GetActivePlayers", "skipped")] == 2 and calls[("trip", "Player.GetProperties", "skipped")] == 1
+
+def test_breaker_probe_recovers_and_wakes_frame(monkeypatch):
+    frame = spare_frame("breaker")
+    n = af.KODI_BREAKER_FAILURES
+    # down for the requests that trip it and the first two probes
+    fake_send(monkeypatch, frame.kodi, [False]*(n + 2))
+    for _ in range(n):
+        frame.kodi.call("JSONRPC.Ping")
+    assert not frame.kodi.up and frame.wake_event.is_set()
+    frame.wake_event.clear()
+    assert wait_until(lambda: frame.kodi.up, 5)
+    assert frame.wake_event.is_set() and frame.kodi.failures == 0 and frame.kodi.health()["error"] is None
+
+def test_events_disconnect_wakes_frame():
+    frame = spare_frame("dropped")
+    frame.events._set_connected(True)
+    frame.wake_event.clear()
+    frame.events._set_connected(False)
+    assert frame.wake_event.is_set()
+    # only changes count: failed reconnects don't keep waking it
+    frame.wake_event.clear()
+    frame.events._set_connected(False)
+    assert not frame.wake_event.is_set()
+
+# ---------------- Light sensor ----------------
+def sampler(monkeypatch, values, **kw):
+    # a LuxSampler on the fake BH1750 that reads `values` in turn (an exception = a failed read)
+    values = iter(values)
+    def source():
+        v = next(values)
+        if isinstance(v, Exception): raise v
+        return v
+    monkeypatch.setattr(bench.FakeSMBus, "source", source)
+    return af.LuxSampler(**{"bus_factory": bench.FakeSMBus, "window": 3, "threshold": 30, "hysteresis": 5, **kw})
+
+def test_lux_median_ignores_spikes(monkeypatch):
+    s = sampler(monkeypatch, [100, 100, 2, 100, 3, 4])
+    flips = []
+    s.listeners.append(flips.append)
+    for _ in range(4): s.sample()
+    assert s.bright() is True and round(s.lux()) == 100
+    for _ in range(2): s.sample()
+    assert s.bright() is False and round(s.lux()) == 3 and flips == [True, False]
+
+def test_lux_hysteresis(monkeypatch):
+    s = sampler(monkeypatch, [40, 26, 26, 26, 24, 34, 34, 36], window=1)
+    seen = []
+    for _ in range(8):
+        s.sample()
+        seen.append(s.bright())
+    assert seen == [True, True, True, True, False, False, False, True]
+
+def test_lux_read_errors(monkeypatch):
+    # a failed read is recorded as None and reopens the bus; the decision keeps the good samples
+    opened = []
+    s = sampler(monkeypatch, [50, OSError("nack"), 50, OSError("nack"), OSError("nack"), OSError("nack")],
+                bus_factory=lambda: opened.append(1) or bench.FakeSMBus())
+    for _ in range(3): s.sample()
+    assert [v is None for _,v in s.history()] == [False, True, False] and len(opened) == 2
+    assert s.bright() is True
+    for _ in range(3): s.sample()
+    assert s.lux() is None and s.bright() is None
+
+def test_lux_status_pushes(monkeypatch):
+    # small drifts don't reach the UI, a sizeable change or a bright/dark flip does
+    s = sampler(monkeypatch, [200, 201, 205, 215, 224, 10], window=1)
+    pushed = []
+    for _ in range(6):
+        v = af.STATE.version
+        s.sample()
+        pushed.append(af.STATE.version > v)
+    assert pushed == [True, False, False, False, True, True]
+
+# ---------------- Schedule ----------------
+def at(day, hhmm):
+    # a datetime on weekday `day` (0 = Monday) of the week of Mon 1 Jan 2024
+    h, m = map(int, hhmm.split(":"))
+    return af.datetime(2024, 1, 1 + day, h, m)
+
+def test_parse_schedule_windows():
+    assert af.parse_schedule_windows("Mon-Fri 07:00-08:30 18:00-23:00; saturday,Sun 9:00-23:30") == [
+        (frozenset(range(5)), 7*3600, 8*3600 + 1800), (frozenset(range(5)), 18*3600, 23*3600),
+        (frozenset({5, 6}), 9*3600, 23*3600 + 1800)]
+    # no days = every day; a day range may wrap past Sunday
+    assert af.parse_schedule_windows("10:00-11:00\nFri-Mon 01:00-02:00") == [
+        (frozenset(range(7)), 36000, 39600), (frozenset({4, 5, 6, 0}), 3600, 7200)]
+    assert af.parse_schedule_windows(" ; ") == []
+
+@pytest.mark.parametrize("spec", ["monkey 10:00-11:00", "Mond 10:00-11:00", "Mon-Fry 10:00-11:00",
+                                  "Mon", "24:00-25:00", "10:60-11:00", "10-11"])
+def test_parse_schedule_windows_errors(spec):
+    with pytest.raises(ValueError):
+        af.parse_schedule_windows(spec)
+
+def test_schedule_allowed():
+    s = af.Schedule(af.parse_schedule_windows("Mon-Fri 18:00-23:00; Sat 22:00-02:00; Sun 23:00-01:00"))
+    assert s.allowed(at(0, "18:00")) and s.allowed(at(4, "22:59")) and not s.allowed(at(0, "23:00"))
+    assert not s.allowed(at(5, "18:30"))
+    # windows past midnight belong to the day they start on, Sunday's into Monday
+    assert s.allowed(at(6, "01:59")) and not s.allowed(at(6, "02:00"))
+    assert s.allowed(at(6, "23:30")) and s.allowed(at(0, "00:30")) and not s.allowed(at(0, "01:00"))
+
+def test_schedule_next_transition():
+    s = af.Schedule(af.parse_schedule_windows("Mon-Fri 18:00-23:00"))
+    assert s.next_transition(at(0, "17:00")) == 3600
+    assert s.next_transition(at(0, "22:00")) == 3600
+    # Friday night to Monday evening
+    assert s.next_transition(at(4, "23:00")) == 2*86400 + 19*3600
+    # touching windows merge: Sunday's runs into Monday's without a transition at midnight
+    s = af.Schedule(af.parse_schedule_windows("Sun 20:00-00:00; Mon 00:00-01:00"))
+    assert s.next_transition(at(6, "21:00")) == 4*3600
+    assert af.Schedule([]).next_transition(at(0, "12:00")) is None
+    assert af.Schedule(af.parse_schedule_windows("00:00-00:00")).next_transition(at(0, "12:00")) is None
+
+# ---------------- Database ----------------
+BASELINE_SHOWS = """CREATE TABLE shows (id INTEGER PRIMARY KEY, name TEXT UNIQUE, order_idx INTEGER,
+                    episode_index INTEGER DEFAULT 0, timestamp TEXT DEFAULT '00:00:00')"""
+
+def migrated(path):
+    conn = sqlite3.connect(path)
+    try:
+        return (conn.execute("SELECT id,frame,name,order_idx,episode_index,position_ms FROM shows ORDER BY id").fetchall(),
+                dict(conn.execute("SELECT key,value FROM settings")))
+    finally:
+        conn.close()
+
+@pytest.mark.parametrize("schema", ["baseline", "frames"])
+def test_migrates_old_db(tmp_path, monkeypatch, schema):
+    # the first version's DB (no frame column, "HH:MM:SS" timestamps) and one from before
+    # position_ms keep their shows, progress and settings; the rows go to the first frame
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    if schema == "baseline":
+        conn.execute(BASELINE_SHOWS)
+        conn.executemany("INSERT INTO shows(id,name,order_idx,episode_index,timestamp) VALUES(?,?,?,?,?)",
+                         [(1, "Old-A", 2, 3, "00:12:00"), (2, "Old-B", 1, 0, "00:00:00"), (3, "Old-C", 3, 1, "bad")])
+    else:
+        conn.execute(BASELINE_SHOWS.replace("name TEXT UNIQUE", "frame TEXT NOT NULL, name TEXT")
+                     .replace("'00:00:00')", "'00:00:00', UNIQUE(frame, name))"))
+        conn.executemany("INSERT INTO shows(id,frame,name,order_idx,episode_index,timestamp) VALUES(?,?,?,?,?,?)",
+                         [(1, "default", "Old-A", 2, 3, "00:12:00"), (2, "default", "Old-B", 1, 0, "00:00:00"),
+                          (3, "default", "Old-C", 3, 1, "bad")])
+    conn.execute("CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT)")
+    conn.executemany("INSERT INTO settings(key,value) VALUES(?,?)",
+                     [("use_light", "0"), ("schedule_enabled", "1"), ("schedule_start", "07:00"), ("schedule_end", "22:00")])
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(af, "DB_FILE", path)
+    af.init_db()
+    rows, settings = migrated(path)
+    assert rows == [(1, "default", "Old-A", 2, 3, 720000), (2, "default", "Old-B", 1, 0, 0), (3, "default", "Old-C", 3, 1, 0)]
+    assert settings == {"use_light": "0", "schedule_enabled": "1", "schedule_start": "07:00", "schedule_end": "22:00"}
+    # a second start leaves it as it is
+    af.init_db()
+    assert migrated(path) == (rows, settings)
+
+# ---------------- Play queue ----------------
+def db_order(frame):
+    return af.db_read("SELECT name FROM shows WHERE frame=? ORDER BY order_idx", (frame,))
+
+@pytest.fixture
+def queue(request):
+    # an empty queue of its own (a frame name no other test uses)
+    return af.PlayQueue("q-" + request.node.name)
+
+def test_queue_add_and_remove(queue):
+    assert queue.add(["a", "b", "a"]) == ["a", "b"]
+    assert queue.add(["b", "c"]) == ["c"]
+    queue.remove("b")
+    assert queue.names() == ["a", "c"] and queue.head() == "a" and queue.position("c") == 1
+    assert [n for n, in db_order(queue.frame)] == ["a", "c"]
+
+def test_queue_moves_persist(queue):
+    queue.add(list("abcde"))
+    queue.rotate("a")
+    queue.move_to_front("d")
+    queue.move_to("e", 2)
+    assert queue.names() == list("dbeca")
+    # a fresh queue reads the same order back from the DB
+    assert af.PlayQueue(queue.frame).names() == list("dbeca")
+    assert [n for n, in db_order(queue.frame)] == list("dbeca")
+
+def test_queue_renumbers_when_out_of_room(queue):
+    # keep inserting between the same two neighbours until the keys between them run out
+    queue.add(["first", "last"])
+    for i in range(20):
+        queue.add([f"s{i}"])
+        queue.move_to(f"s{i}", 1)
+    assert queue.names() == ["first"] + [f"s{i}" for i in reversed(range(20))] + ["last"]
+    keys = [k for k, in af.db_read("SELECT order_idx FROM shows WHERE frame=? ORDER BY order_idx", (queue.frame,))]
+    assert len(set(keys)) == len(keys) and af.PlayQueue(queue.frame).names() == queue.names()
+
+def test_queue_reorder_and_also(queue):
+    queue.add(list("abcd"))
+    assert queue.reorder(["c", "x", "a"]) == list("cabd")
+    # extra statements commit together with the move
+    queue.rotate("c", also=[("UPDATE shows SET episode_index=7 WHERE frame=? AND name=?", (queue.frame, "c"))])
+    assert queue.names() == list("abdc")
+    assert af.db_read("SELECT episode_index FROM shows WHERE frame=? AND name='c'", (queue.frame,)) == [(7,)]
+
+def test_queue_repairs_old_keys(queue):
+    # old DBs can hold duplicate or NULL order keys; they are renumbered on load (NULL first, ties by id)
+    with af.db_transaction() as conn:
+        conn.executemany("INSERT INTO shows(frame,name,order_idx) VALUES(?,?,?)",
+                         [(queue.frame, n, k) for n,k in [("a", 5), ("b", None), ("c", 5), ("d", 1)]])
+    assert queue.names() == list("bdac")
+    keys = [k for k, in af.db_read("SELECT order_idx FROM shows WHERE frame=? ORDER BY order_idx", (queue.frame,))]
+    assert keys == [af.PlayQueue.GAP * (i+1) for i in range(4)]
+
+# ---------------- Progress journal ----------------
+@pytest.fixture
+def journal(request):
+    # a journal (60 sec interval) for a frame of its own with shows a, b, c
+    name = "pj-" + request.node.name
+    af.PlayQueue(name).add(["a", "b", "c"])
+    return af.ProgressJournal(name, interval=60)
+
+def saved(journal):
+    return af.db_read("SELECT name,episode_index,position_ms FROM shows WHERE frame=? ORDER BY name", (journal.frame,))
+
+def test_journal_coalesces(journal):
+    for ms in (1000, 2000, 3000):
+        journal.record("a", 1, ms)
+    journal.record("b", 0, 500)
+    assert saved(journal) == [("a", 0, 0), ("b", 0, 0), ("c", 0, 0)]
+    assert journal.flush() == 2 and journal.flush() == 0
+    assert saved(journal) == [("a", 1, 3000), ("b", 0, 500), ("c", 0, 0)]
+    assert journal.stats == {"recorded": 4, "coalesced": 2, "flushes": 1, "rows_written": 2}
+
+def test_journal_flushes_when_due(journal):
+    journal.record("a", 0, 1000)
+    assert saved(journal)[0] == ("a", 0, 0) and 59 < journal.due_in() <= 60
+    journal.last_flush -= 61    # the interval has passed
+    assert journal.due_in() < 0
+    journal.record("a", 0, 61000)
+    assert saved(journal)[0] == ("a", 0, 61000) and 59 < journal.due_in() <= 60
+
+def test_journal_overlay_and_discard(journal):
+    rows = [("a", 1024, 0, 0), ("b", 2048, 2, 100)]
+    journal.record("b", 3, 4000)
+    assert journal.overlay(rows) == [("a", 1024, 0, 0), ("b", 2048, 3, 4000)]
+    journal.discard("b")
+    assert journal.overlay(rows) == rows and journal.flush() == 0
+
+def test_journal_keeps_progress_after_failed_flush(journal, monkeypatch):
+    journal.record("a", 0, 1000)
+    journal.record("b", 0, 2000)
+    def locked():
+        raise af.sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(af, "db_transaction", locked)
+    with pytest.raises(af.sqlite3.OperationalError):
+        journal.flush()
+    # newer progress recorded meanwhile wins over the batch that failed
+    journal.record("a", 0, 5000)
+    monkeypatch.undo()
+    assert journal.flush() == 2
+    assert saved(journal) == [("a", 0, 5000), ("b", 0, 2000), ("c", 0, 0)]
+
+# ---------------- Posters ----------------
+def test_poster_pillow_failure_serves_original(monkeypatch):
+    # a poster Pillow can't convert is served as it is, not replaced by the fallback
+    from PIL import Image
+    make_show("Poster-A", 1)
+    src = os.path.join(af.ANIME_DIR, "Poster-A", "poster.jpg")
+    Image.new("RGB", (40, 60), (200, 30, 30)).save(src)
+    def fail(*a, **kw): raise OSError("encoder not available")
+    monkeypatch.setattr(Image.Image, "save", fail)
+    key, path = af.POSTERS.build("Poster-A")
+    assert path == src and not [f for f in os.listdir(af.POSTERS.dir) if f.endswith(".tmp")]
+    r = af.app.test_client().get("/poster/Poster-A")
+    with open(src, "rb") as f:
+        assert r.status_code == 200 and r.data == f.read() and r.headers["ETag"].strip('"') == key
+
+# ---------------- State API ----------------
+def test_status_delta_skips_the_playlist(monkeypatch):
+    # a light level or Kodi status change reaches every open UI; it mustn't read the playlist
+    client = af.app.test_client()
+    version = client.get("/api/state?limit=10").get_json()["version"]
+    reads = []
+    monkeypatch.setattr(af, "db_all_shows", lambda frame=None: reads.append(frame) or [])
+    af.STATE.touch(status=True)
+    st = client.get(f"/api/state?since={version}&limit=10").get_json()
+    assert not reads and st["playlist"] == [] and st["removed"] == [] and "total" not in st and "lux" in st
+    af.STATE.touch(shows=["a"])
+    st = client.get(f"/api/state?since={st['version']}&limit=10").get_json()
+    assert len(reads) == 1 and st["total"] == 0
+
+def test_frame_settings_fall_back_to_the_first():
+    # the hall frame uses the first frame's settings until it has its own ("hall/<key>")
+    first, hall = af.FRAMES
+    client = af.app.test_client()
+    assert hall.setting("schedule_start") == first.setting("schedule_start")
+    try:
+        r = client.post("/api/settings?frame=hall", json={"use_light": True, "schedule_enabled": False,
+            "schedule_start": "06:00", "schedule_end": "07:00", "schedule_windows": "Sat 10:00-12:00"})
+        assert r.get_json()["success"]
+        assert af.SETTINGS.get("hall/schedule_windows") == "Sat 10:00-12:00"
+        assert hall.setting("schedule_windows") == "Sat 10:00-12:00" and not first.setting("schedule_windows")
+        assert hall.scheduler.schedule().starts != first.scheduler.schedule().starts
+        assert client.get("/api/state?frame=hall").get_json()["schedule_windows"] == "Sat 10:00-12:00"
+        assert client.get("/api/state").get_json()["schedule_windows"] == ""
+    finally:
+        with af.db_transaction() as conn:
+            conn.execute("DELETE FROM settings WHERE key LIKE 'hall/%'")
+        af.SETTINGS._values = None
+    assert hall.setting("schedule_start") == first.setting("schedule_start")
+
+# ---------------- Playback ----------------
+def make_show(name, episodes):
+    d = os.path.join(af.ANIME_DIR, name)
+    os.makedirs(d)
+    for i in range(episodes):
+        open(os.path.join(d, f"e{i+1:02d}.mkv"), "w").close()
+    return [os.path.join(d, f"e{i+1:02d}.mkv") for i in range(episodes)]
+
+def progress(frame, name):
+    return af.db_read("SELECT episode_index,position_ms FROM shows WHERE frame=? AND name=?", (frame.name, name))[0]
+
+def test_next_up():
+    # a frame of its own: only its name and queue are used
+    frame = types.SimpleNamespace(name="nextup", queue=af.PlayQueue("nextup"))
+    a, b, c = make_show("NU-A", 2), make_show("NU-B", 1), make_show("NU-C", 3)
+    os.makedirs(os.path.join(af.ANIME_DIR, "NU-Empty"))
+    frame.queue.add(["NU-A", "NU-Empty", "NU-B", "NU-C"])
+    with af.db_transaction() as conn:
+        conn.execute("UPDATE shows SET episode_index=1, position_ms=5000 WHERE frame='nextup' AND name='NU-C'")
+    assert af.next_up(frame, "NU-A", 0) == ("NU-A", 1, a[1], 0)
+    # a finished show is followed by the next show with episodes, from its saved progress
+    assert af.next_up(frame, "NU-A", 1) == ("NU-B", 0, b[0], 0)
+    # ...and that is the head of the queue once it moved to the back, even if a show was put in
+    # front of the one playing (Start on a card)
+    frame.queue.move_to_front("NU-C")
+    assert af.next_up(frame, "NU-A", 1) == ("NU-C", 1, c[1], 5000)
+    frame.queue.move_to_front("NU-A")
+    assert af.next_up(frame, "NU-A", 1) == ("NU-C", 1, c[1], 5000)
+    # the only show with episodes starts over
+    for n in ("NU-B", "NU-C"): frame.queue.remove(n)
+    assert af.next_up(frame, "NU-A", 1) == ("NU-A", 0, a[0], 0)
+
+EPISODE_SPEED = bench.EPISODE_SECS / 1.5     # fake Kodi episodes last 1.5 sec
+
+def light(frame, lux):
+    # fill the frame's sensor window with `lux`
+    bench.FakeSMBus.lux = lux
+    for _ in range(frame.lux.window): frame.lux.sample()
+
+@pytest.fixture
+def playback(kodis, monkeypatch):
+    # the first frame on a fresh fake Kodi, light sensor (shared by the frames) on and bright, no
+    # schedule; start(frame) runs a frame's playback thread (default: the first's), which is
+    # stopped again afterwards (going dark ends the episode loop)
+    frame = af.FRAMES[0]
+    kodis[0]("Bench.Reset", {"speed": EPISODE_SPEED})
+    monkeypatch.setattr(bench.FakeSMBus, "lux", 200.0)
+    light(frame, 200)
+    frame.update_settings({"use_light": "1", "schedule_enabled": "0"})
+    threads = {}
+    def start(f=frame):
+        threads[f] = threading.Thread(target=af.playback_thread, args=(f,), daemon=True)
+        threads[f].start()
+    yield frame, start
+    light(frame, 0)
+    assert wait_until(lambda: all(f.now_playing["show"] is None for f in threads))
+    monkeypatch.setattr(af, "running", False)
+    for f,t in threads.items():
+        f.wake()
+        t.join(10)
+        assert not t.is_alive()
+
+def play_to_third_episode(frame, start, name):
+    make_show(name, 5)
+    frame.queue.add([name])
+    frame.queue.move_to_front(name)
+    start()
+    # two gapless transitions, then part way into the third episode
+    assert wait_until(lambda: frame.now_playing == {"show": name, "episode_index": 2})
+    time.sleep(0.3)
+
+@pytest.mark.parametrize("cutoff", ["dark", "remote stop"])
+def test_stop_after_gapless_transitions(playback, kodi, cutoff):
+    # stopping part way through an episode Kodi rolled into keeps that episode and position
+    frame, start = playback
+    name = "Stop-" + cutoff.replace(" ", "-")
+    play_to_third_episode(frame, start, name)
+    if cutoff == "dark": light(frame, 0)
+    else: kodi("Player.Stop", {"playerid": 1})
+    assert wait_until(lambda: frame.now_playing["show"] is None)
+    ep, ms = progress(frame, name)
+    assert ep == 2
+    if cutoff == "dark": assert 0 < ms < bench.EPISODE_SECS*1000
+
+def test_finished_show_rotates(playback):
+    # Kodi rolls from a show's last episode into the next show; the finished one starts over at
+    # the back of the queue
+    frame, start = playback
+    make_show("Rotate-A", 1)
+    make_show("Rotate-B", 2)
+    frame.queue.add(["Rotate-A", "Rotate-B"])
+    frame.queue.move_to_front("Rotate-B")
+    frame.queue.move_to_front("Rotate-A")
+    start()
+    assert wait_until(lambda: frame.now_playing == {"show": "Rotate-B", "episode_index": 0})
+    assert progress(frame, "Rotate-A") == (0, 0)
+    assert frame.queue.head() == "Rotate-B" and frame.queue.names()[-1] == "Rotate-A"
+
+def test_one_failed_poll_keeps_the_episode(playback, kodi, monkeypatch):
+    # a single failed status poll (e.g. one timeout on a busy Kodi) neither trips the breaker nor
+    # restarts the episode from its last recorded position
+    frame, start = playback
+    monkeypatch.setattr(af, "KODI_HEARTBEAT", 0.2)
+    kodi("Bench.Reset", {"speed": 1.0})
+    make_show("Flaky", 3)
+    frame.queue.add(["Flaky"])
+    frame.queue.move_to_front("Flaky")
+    start()
+    assert wait_until(lambda: frame.now_playing == {"show": "Flaky", "episode_index": 0})
+    send, failed = frame.kodi._send, []
+    def flaky(payload, timeout):
+        if not failed and "Player.GetProperties" in json.dumps(payload):
+            failed.append(time.monotonic())
+            raise requests.Timeout("read timed out")
+        return send(payload, timeout)
+    monkeypatch.setattr(frame.kodi, "_send", flaky)
+    assert wait_until(lambda: failed)
+    seen = set()
+    while time.monotonic() - failed[0] < 1:
+        seen.add(frame.now_playing["show"])
+        time.sleep(0.01)
+    assert seen == {"Flaky"} and frame.kodi.up and kodi("Bench.Stats")["calls"]["Player.Open"] == 1
+
+def test_progress_written_every_flush_interval(playback, kodi, monkeypatch):
+    # with notifications connected Kodi is only polled every KODI_HEARTBEAT sec, but a flush that
+    # is due still writes the current position
+    frame, start = playback
+    monkeypatch.setattr(frame.progress, "interval", 0.5)
+    kodi("Bench.Reset", {"speed": 10.0})
+    make_show("Journal", 2)
+    frame.queue.add(["Journal"])
+    frame.queue.move_to_front("Journal")
+    start()
+    assert wait_until(lambda: frame.now_playing == {"show": "Journal", "episode_index": 0})
+    assert wait_until(lambda: progress(frame, "Journal")[1] >= 10000, 5)
+
+def test_frames_play_independently(playback, kodis):
+    # two frames on their own Kodis each play their own show and keep their own progress
+    first, start = playback
+    hall = af.FRAMES[1]
+    kodis[1]("Bench.Reset", {"speed": EPISODE_SPEED})
+    files = {"MF-A": make_show("MF-A", 4), "MF-B": make_show("MF-B", 4)}
+    af.db_add_shows(list(files))
+    first.queue.move_to_front("MF-A")
+    hall.queue.move_to_front("MF-B")
+    start(first)
+    start(hall)
+    assert wait_until(lambda: first.now_playing == {"show": "MF-A", "episode_index": 1}
+                      and hall.now_playing == {"show": "MF-B", "episode_index": 1})
+    for k, name in zip(kodis, ("MF-A", "MF-B")):
+        st = k("Bench.Stats")
+        assert st["played"] >= 1 and st["playlist"] and set(st["playlist"]) <= set(files[name])
+    light(first, 0)
+    assert wait_until(lambda: first.now_playing["show"] is None and hall.now_playing["show"] is None)
+    assert progress(first, "MF-A")[0] >= 1 and progress(hall, "MF-B")[0] >= 1
+    assert progress(first, "MF-B") == (0, 0) and progress(hall, "MF-A") == (0, 0)